@@ -0,0 +1,198 @@
+#!/usr/bin/env python
+# vim: set fileencoding=utf-8 :
+
+'''Persistent caches for the chords plugin
+
+Caches are stored under Pelican's ``CACHE_PATH`` and survive across runs, so
+that unchanged songs are not re-processed on every build.
+'''
+
+import os
+import hashlib
+import pickle
+
+import logging
+logger = logging.getLogger(__name__)
+
+import pelican.cache
+
+from . import parser, contents
+
+
+def parser_version():
+  '''Returns a hash of the parser (and song model) source code
+
+  Any modification to the parser (and, therefore, to the structure of parsed
+  songs or their HTML rendering) invalidates previously cached results.
+  '''
+
+  h = hashlib.sha1()
+  for k in (parser, contents):
+    with open(k.__file__, 'rb') as f: h.update(f.read())
+  return h.hexdigest()
+
+
+class ParseCache(pelican.cache.FileDataCacher):
+  '''An on-disk cache for parsed songs, keyed by song content hash
+
+  Entries hold the parsed items of songs as well as their rendered HTML (see
+  :py:meth:`.contents.Song.rendered`). Each entry records the parser version
+  it was produced with and the build generation it was last used on. Entries
+  from other parser versions are evicted when the cache is saved, as well as
+  the least recently used entries if the cache grows past its size bound.
+
+
+  Parameters:
+
+    settings (dict): Pelican settings
+
+    enabled (bool): If the cache should be loaded and saved at all
+
+    size (int): The maximum number of songs kept in the cache
+
+  '''
+
+  def __init__(self, settings, enabled, size):
+    super(ParseCache, self).__init__(settings, 'chords_parse_cache', enabled,
+        enabled)
+    self.size = size
+    self.version = parser_version()
+    self.generation = self._cache.get('generation', 0) + 1
+    self.entries = self._cache.get('entries', {})
+    self.hits = 0
+    self.misses = 0
+    self.evicted = 0
+
+
+  def load(self, songs, workers=1):
+    '''Sets up the parsed items and HTML of songs, re-using cached results if
+    possible
+
+    Songs that are not in the cache are parsed with
+    :py:func:`.parser.parse_many`. The time it took to parse each song is set
+    on its ``parse_time`` attribute (``None`` for songs loaded from cache).
+
+
+    Parameters:
+
+      songs (list): The songs to parse
+
+      workers (int): The number of processes to use for parsing
+
+    '''
+
+    missing = []
+    for song in songs:
+      digest = song.digest
+      entry = self.entries.get(digest)
+
+      setattr(song, 'parse_time', None)
+      if entry is not None and entry[0] == self.version:
+        try:
+          song.set_items(pickle.loads(entry[2]))
+          song.set_html(*entry[3])
+          self.entries[digest] = (entry[0], self.generation) + entry[2:]
+          self.hits += 1
+          continue
+        except Exception as e:
+          logger.debug('Cannot unpickle cached items of %s (%s), re-parsing',
+              song.slug, e)
+
+      missing.append(song)
+
+    items = parser.parse_many([k.song for k in missing], workers, timed=True)
+    for song, (k, seconds) in zip(missing, items):
+      song.set_items(k, parsed=True)
+      setattr(song, 'parse_time', seconds)
+      self.entries[song.digest] = (self.version, self.generation,
+          pickle.dumps(k, pickle.HIGHEST_PROTOCOL), song.rendered())
+    self.misses += len(missing)
+
+
+  def save_cache(self):
+    '''Evicts stale entries and saves the cache to disk'''
+
+    size = len(self.entries)
+    entries = [(k, v) for k, v in self.entries.items() if v[0] == self.version]
+    entries.sort(key=lambda x: x[1][1], reverse=True) #most recent first
+    self.entries = dict(entries[:self.size])
+    self.evicted += size - len(self.entries)
+
+    self._cache = dict(generation=self.generation, entries=self.entries)
+    super(ParseCache, self).save_cache()
+
+
+  def __str__(self):
+    return '{} songs parsed, {} loaded from cache, {} cache entries ' \
+        'evicted'.format(self.misses, self.hits, self.evicted)
+
+
+class BuildManifest(pelican.cache.FileDataCacher):
+  '''Records a digest of the inputs of each output file produced by a build
+
+  On the next build, outputs whose inputs did not change (and that still
+  exist on disk) can be skipped. Outputs that are not produced or checked
+  during a build are dropped from the manifest when it is saved.
+
+
+  Parameters:
+
+    settings (dict): Pelican settings
+
+    enabled (bool): If the manifest should be loaded and saved at all
+
+  '''
+
+  def __init__(self, settings, enabled):
+    super(BuildManifest, self).__init__(settings, 'chords_build_manifest',
+        enabled, enabled)
+    self.enabled = enabled
+    self.previous = self._cache
+    self._cache = {}
+    self._files = {}
+    self.skipped = 0
+    self.built = 0
+
+
+  def file_digest(self, path):
+    '''Returns the (memoized) hash of the contents of a file'''
+
+    if path not in self._files:
+      with open(path, 'rb') as f:
+        self._files[path] = hashlib.sha1(f.read()).hexdigest()
+    return self._files[path]
+
+
+  def digest(self, *values):
+    '''Returns a hash of the given strings, that identifies an output'''
+
+    h = hashlib.sha1()
+    for k in values: h.update(k.encode('utf-8') + b'\0')
+    return h.hexdigest()
+
+
+  def up_to_date(self, filename, digest):
+    '''Tells if the output was built from inputs with the same digest
+
+    If so, the output is kept in the manifest and counted as skipped.
+    '''
+
+    if self.enabled and self.previous.get(filename) == digest and \
+        os.path.exists(filename):
+      self._cache[filename] = digest
+      self.skipped += 1
+      return True
+
+    return False
+
+
+  def record(self, filename, digest):
+    '''Records the digest of the inputs for an output that was just built'''
+
+    self._cache[filename] = digest
+    self.built += 1
+
+
+  def __str__(self):
+    return '{} outputs built, {} up-to-date outputs skipped'.format(
+        self.built, self.skipped)
@@ -4,6 +4,8 @@
 '''Base classes defining the component model for this plugin'''
 
 
+import hashlib
+
 import pelican.contents
 
 from . import parser
@@ -26,6 +28,9 @@ class Song(pelican.contents.Content):
   default_template = 'song'
   list_template = 'songs'
 
+  # counts how many times songs were effectively parsed, across all objects
+  parse_count = 0
+
 
   @property
   def two_columns(self):
@@ -33,10 +38,49 @@ class Song(pelican.contents.Content):
     return self.metadata.get('two-columns', False)
 
 
+  @property
+  def digest(self):
+    '''A hash of the song contents, that changes if the song is modified'''
+
+    return hashlib.sha1(self.song.encode('utf-8')).hexdigest()
+
+
   def items(self):
-    '''Parses and returns the lines of the song as specialized items'''
+    '''Parses and returns the lines of the song as specialized items
+
+    The parsed items are cached in this object and only re-computed if the
+    song contents change.
+    '''
+
+    digest = self.digest
+    if getattr(self, '_items_digest', None) != digest:
+      self._items = parser.syntax_analysis(parser.parse(self.song))
+      self._items_digest = digest
+      Song.parse_count += 1
+    return self._items
+
 
-    return parser.syntax_analysis(parser.parse(self.song))
+  def set_items(self, items, parsed=False):
+    '''Sets the parsed items for the current song contents, skipping parsing
+
+    Set ``parsed`` if the items were just parsed elsewhere (as opposed to
+    loaded from a cache), so they are accounted for in ``parse_count``.
+    '''
+
+    self._items = items
+    self._items_digest = self.digest
+    if parsed: Song.parse_count += 1
+
+
+  @staticmethod
+  def column_cut(n):
+    '''Returns how many of ``n`` items go on the first of 2 columns'''
+
+    cut = int(round(n/2))
+    if n%2 == 1:
+      #if the number of elements is odd, put more on the first column
+      cut += 1
+    return cut
 
 
   def items_by_column(self):
@@ -45,13 +89,51 @@ class Song(pelican.contents.Content):
     i = self.items()
     if len(i) <= 1: return i
     #else, we can split it better
-    cut = int(round(len(i)/2))
-    if len(i)%2 == 1:
-      #if the number of elements is odd, put more on the first column
-      cut += 1
+    cut = self.column_cut(len(i))
     return (i[:cut], i[cut:])
 
 
+  def rendered(self):
+    '''Renders the lyrics and chords of the song as an HTML fragment
+
+    Returns the fragment and the offset at which its second column (see
+    :py:meth:`items_by_column`) starts. The result is cached in this object
+    and only re-computed if the song contents change.
+    '''
+
+    digest = self.digest
+    if getattr(self, '_html_digest', None) != digest:
+      items = self.items()
+      cut = self.column_cut(len(items)) if len(items) > 1 else len(items)
+      first = parser.render_html(items[:cut])
+      self._html = (first + parser.render_html(items[cut:]), len(first))
+      self._html_digest = digest
+    return self._html
+
+
+  def set_html(self, html, cut):
+    '''Sets the rendered HTML for the current song contents, skipping
+    rendering (see :py:meth:`rendered`)'''
+
+    self._html = (html, cut)
+    self._html_digest = self.digest
+
+
+  @property
+  def html(self):
+    '''The lyrics and chords of the song, as a ready-to-insert HTML fragment'''
+
+    return self.rendered()[0]
+
+
+  @property
+  def html_by_column(self):
+    '''The same as ``html``, but split in 2 columns'''
+
+    html, cut = self.rendered()
+    return (html[:cut], html[cut:])
+
+
 class Collection(pelican.contents.Content):
   '''A collection corresponds to a list of songs with a name
   '''
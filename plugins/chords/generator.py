@@ -10,10 +10,16 @@ application. It may also accumulate them for later output generator.
 
 import os
 import time
+import shutil
 import datetime
+import json
+import hashlib
 import itertools
+import multiprocessing
+import concurrent.futures
 import yaml
 import pkg_resources
+import PIL.Image
 
 import logging
 logger = logging.getLogger(__name__)
@@ -23,6 +29,10 @@ import pelican.signals
 import pelican.utils
 
 from .contents import Artist, Song, Collection
+from .cache import ParseCache, BuildManifest
+from . import instrument
+from .instrument import Recorder, peak_rss, reset_peak_rss
+from .pdf import artist_color, layout_times
 
 
 _DEFAULT_SETTINGS = dict(
@@ -32,11 +42,137 @@ _DEFAULT_SETTINGS = dict(
     CHORDS_SONGS_EXCLUDES = [],
     CHORDS_COLLECTIONS_PATHS = [os.path.join('chords', 'collections')],
     CHORDS_COLLECTIONS_EXCLUDES = [],
+    CHORDS_PARSE_CACHE = True,
+    CHORDS_PARSE_CACHE_SIZE = 5000,
+    CHORDS_PARSE_WORKERS = 1,
+    CHORDS_LOAD_WORKERS = 4,
+    CHORDS_INCREMENTAL = True,
+    CHORDS_PDF_WORKERS = 1,
+    CHORDS_PDF_PRERENDER = True,
+    CHORDS_PDF_VERIFY_HEIGHTS = False,
+    CHORDS_THUMBNAIL_HEIGHT = 200,
+    CHORDS_BUILD_REPORT = 'chords_build_report.json',
+    CHORDS_BUILD_BASELINE = None,
+    CHORDS_REGRESSION_THRESHOLD = 0.25,
+    CHORDS_REPORT_TOP = 5,
+    CHORDS_PROFILE = None,
     )
 
+# settings that change how the build runs or what it reports, but not its
+# outputs: they are not part of the build digest
+_EXECUTION_SETTINGS = frozenset((
+    'CHORDS_PARSE_CACHE',
+    'CHORDS_PARSE_CACHE_SIZE',
+    'CHORDS_PARSE_WORKERS',
+    'CHORDS_LOAD_WORKERS',
+    'CHORDS_INCREMENTAL',
+    'CHORDS_PDF_WORKERS',
+    'CHORDS_PDF_VERIFY_HEIGHTS',
+    'CHORDS_BUILD_REPORT',
+    'CHORDS_BUILD_BASELINE',
+    'CHORDS_REGRESSION_THRESHOLD',
+    'CHORDS_REPORT_TOP',
+    'CHORDS_PROFILE',
+    ))
+
 _UNKNOWN_IMAGE_PATH = pkg_resources.resource_filename(__name__,
     os.path.join('img', 'unknown.jpg'))
 
+# use libyaml bindings if they are available, as they are a lot faster
+_YAML_LOADER = getattr(yaml, 'CSafeLoader', yaml.SafeLoader)
+
+
+# PDF generation jobs, inherited by forked worker processes
+_PDF_JOBS = []
+
+
+def _run_pdf_job(index):
+  """Runs one of the PDF generation jobs in ``_PDF_JOBS``
+
+  Returns the start and end (monotonic) times, the CPU time spent, the peak
+  resident set size while running the job (or of the process, up to its end,
+  if it cannot be reset, see :py:func:`.instrument.reset_peak_rss`), the
+  number of pages of the document and the time spent laying out each song (see
+  :py:data:`.pdf.layout_times`).
+  """
+
+  function, args = _PDF_JOBS[index]
+  layout_times.clear()
+  reset_peak_rss()
+  start = time.monotonic()
+  cpu = time.process_time()
+  doc = function(*args)
+  return start, time.monotonic(), time.process_time() - cpu, peak_rss(), \
+      doc.page, dict(layout_times)
+
+
+def _run_pdf_jobs(jobs, workers):
+  """Runs PDF generation jobs, in order, possibly on a pool of processes
+
+  Jobs are ``(function, args)`` tuples. Arguments are not pickled: workers are
+  forked once jobs are known and find them on ``_PDF_JOBS``. Where forking is
+  not available, or for a single worker, jobs run on this process.
+
+  Returns the timings of each job, see :py:func:`_run_pdf_job`.
+  """
+
+  global _PDF_JOBS
+  _PDF_JOBS = jobs
+
+  try:
+    workers = min(workers, len(jobs))
+    if workers < 2 or 'fork' not in multiprocessing.get_all_start_methods():
+      return [_run_pdf_job(k) for k in range(len(jobs))]
+
+    with multiprocessing.get_context('fork').Pool(workers) as pool:
+      results = [pool.apply_async(_run_pdf_job, (k,)) for k in range(len(jobs))]
+      return [k.get() for k in results]
+
+  finally:
+    _PDF_JOBS = []
+
+
+def _load_yaml(path):
+  """Reads and decodes a YAML file
+
+  Exceptions are returned instead of raised, so they can be reported in order
+  after this function is called on a pool of workers.
+  """
+
+  try:
+    with pelican.utils.pelican_open(path) as _file:
+      data = yaml.load(_file, Loader=_YAML_LOADER)
+    # transform date objects in datetime to improve pelican compat.
+    for key, value in data.items():
+      if isinstance(value, datetime.date):
+        data[key] = datetime.datetime.combine(value, datetime.time(0,0))
+    return data
+  except Exception as e:
+    return e
+
+
+def _make_thumbnail(source, filename, height):
+  """Writes a JPEG copy of a picture, scaled down to a height in pixels
+
+  Pictures that are not higher than that are copied as they are. Exceptions
+  are returned instead of raised, so they can be reported in order after this
+  function is called on a pool of workers.
+  """
+
+  try:
+    temporary = filename + '.tmp'
+    with PIL.Image.open(source) as image:
+      if image.height <= height and image.format == 'JPEG':
+        shutil.copyfile(source, temporary)
+      else:
+        image = image.convert('RGB')
+        image.thumbnail((image.width, height), PIL.Image.LANCZOS)
+        image.save(temporary, 'JPEG', quality=90, optimize=True)
+    os.replace(temporary, filename)
+  except Exception as e:
+    return e
+
+
 class Generator(pelican.generators.CachingGenerator):
   """Generate context for chords items (artists, songs and collections)"""
 
@@ -44,130 +180,309 @@ class Generator(pelican.generators.CachingGenerator):
     self.artists = []
     self.songs = []
     self.collections = []
-    self.start = time.time()
+    self.start = time.monotonic()
+    self.instrument = Recorder(self)
+    Song.parse_count = 0
     super(Generator, self).__init__(*args, **kwargs)
 
+    # profiles phases of the build if requested, e.g. CHORDS_PROFILE=cprofile
+    profile = os.environ.get('CHORDS_PROFILE', self.settings.get(
+      'CHORDS_PROFILE', _DEFAULT_SETTINGS['CHORDS_PROFILE']))
+    if profile:
+      directory = os.path.join(self.settings.get('CACHE_PATH', 'cache'),
+          'chords_profile')
+      try:
+        self.instrument.profile(profile, directory)
+      except ValueError as e:
+        logger.error('Could not set up profiling (CHORDS_PROFILE=%s)\n%s',
+            profile, e)
+
 
   def generate_context(self):
     """Process all meaningful data for the chords application"""
 
+    with self.instrument.span('context'):
+      self._generate_context()
+
+
+  def _generate_context(self):
+    """Loads, links and parses all artists, songs and collections"""
+
     _artists = {}
     _songs = {}
     _collections = {}
 
-    for klass, _dict in ((Artist, _artists), (Song, _songs), (Collection,
-      _collections)):
-
+    files = {}
+    for klass in (Artist, Song, Collection):
       paths = 'CHORDS_%sS_PATHS' % klass.__name__.upper()
       paths = self.settings.get(paths, _DEFAULT_SETTINGS[paths])
       excludes = 'CHORDS_%sS_EXCLUDES' % klass.__name__.upper()
       excludes = self.settings.get(excludes, _DEFAULT_SETTINGS[excludes])
-      container = getattr(self, '%ss' % klass.__name__.lower())
+      files[klass] = sorted(self.get_files(paths, excludes,
+        extensions=['yml', 'yaml']))
+
+    # reads and decodes files that are not cached on a pool of threads. Objects
+    # are created and linked afterwards, in order, on this thread.
+    pending = [f for k in files.values() for f in k \
+        if self.get_cached_data(f, None) is None]
+    workers = self.settings.get('CHORDS_LOAD_WORKERS',
+        _DEFAULT_SETTINGS['CHORDS_LOAD_WORKERS'])
+    with self.instrument.span('load', files=len(pending)), \
+        concurrent.futures.ThreadPoolExecutor(max(workers, 1)) as executor:
+      loaded = executor.map(_load_yaml,
+          [os.path.join(self.path, f) for f in pending])
+      loaded = dict(zip(pending, loaded))
+
+    with self.instrument.span('link'):
+      for klass, _dict in ((Artist, _artists), (Song, _songs), (Collection,
+        _collections)):
+
+        container = getattr(self, '%ss' % klass.__name__.lower())
 
-      for f in self.get_files(paths, excludes, extensions=['yml', 'yaml']):
+        for f in files[klass]:
 
-        obj = self.get_cached_data(f, None)
+          obj = self.get_cached_data(f, None)
 
-        if obj is None: # try to load it from disk
+          if obj is None: # create it from the data loaded from disk
 
-          try:
+            try:
 
-            path = os.path.join(self.path, f)
-            with pelican.utils.pelican_open(path) as _file:
-              data = yaml.load(_file)
-              # transform date objects in datetime to improve pelican compat.
-              for key, value in data.items():
-                if isinstance(value, datetime.date):
-                  data[key] = datetime.datetime.combine(value,
-                      datetime.time(0,0))
+              path = os.path.join(self.path, f)
+              data = loaded[f]
+              if isinstance(data, Exception): raise data
               obj = klass('', data, self.settings, f, self.context)
+              if klass == Artist:
+                setattr(obj, 'pdf_color', artist_color(data.get('color')))
 
-          except Exception as e:
-              logger.error(
-                  'Could not process %s\n%s', f, e,
-                  exc_info=self.settings.get('DEBUG', False))
-              self._add_failed_source_path(f)
-              continue
-
-          # setup slug for chord objects
-          setattr(obj, 'slug', getattr(obj, 'slug',
-            os.path.basename(os.path.splitext(obj.source_path)[0])))
-
-          if klass == Artist:
-            # use this image for the artist
-            img = os.path.splitext(path)[0] + '.jpg'
-            if not os.path.exists(img): img = _UNKNOWN_IMAGE_PATH
-            setattr(obj, 'image_path', img)
-
-            # initializes song list
-            setattr(obj, 'songs', [])
-
-          if klass == Song:
-            for artist in ('performer', 'composer'):
-              slug = data.get('%s-slug' % artist)
-              if slug is not None:
-                if slug in _artists:
-                  setattr(obj, artist, _artists[slug])
-                  if obj not in _artists[slug].songs:
-                    _artists[slug].songs.append(obj)
-                else:
-                  logger.error('Could not process %s\nCannot link %s', f,
-                      artist)
-                  self._add_failed_source_path(f)
-                  continue
+            except Exception as e:
+                logger.error(
+                    'Could not process %s\n%s', f, e,
+                    exc_info=self.settings.get('DEBUG', False))
+                self._add_failed_source_path(f)
+                continue
 
-          if klass == Collection:
-            setattr(obj, 'songs', [])
-            for slug in obj.metadata['song-slugs']:
-              if slug in _songs:
-                obj.songs.append(_songs[slug])
-              else:
-                logger.error('Could not process %s\nCannot link %s', f, slug)
+            # setup slug for chord objects
+            setattr(obj, 'slug', getattr(obj, 'slug',
+              os.path.basename(os.path.splitext(obj.source_path)[0])))
+
+            if klass == Artist:
+              # use this image for the artist
+              img = os.path.splitext(path)[0] + '.jpg'
+              if not os.path.exists(img): img = _UNKNOWN_IMAGE_PATH
+              setattr(obj, 'image_path', img)
+
+              # initializes song list
+              setattr(obj, 'songs', [])
+
+            if klass == Song:
+              slugs = [(k, data.get('%s-slug' % k)) for k in ('performer',
+                'composer')]
+              slugs = [(k, v) for k, v in slugs if v is not None]
+              missing = [k for k, v in slugs if v not in _artists]
+              if missing: # e.g., the artist failed to load
+                logger.error('Could not process %s\nCannot link %s', f,
+                    ', '.join(missing))
                 self._add_failed_source_path(f)
                 continue
+              for artist, slug in slugs:
+                setattr(obj, artist, _artists[slug])
+                if obj not in _artists[slug].songs:
+                  _artists[slug].songs.append(obj)
+
+            if klass == Collection:
+              setattr(obj, 'songs', [])
+              for slug in obj.metadata['song-slugs']:
+                if slug in _songs:
+                  obj.songs.append(_songs[slug])
+                else:
+                  logger.error('Could not process %s\nCannot link %s', f, slug)
+                  self._add_failed_source_path(f)
+                  continue
 
-          self.cache_data(f, obj)
+            self.cache_data(f, obj)
 
-        container.append(obj)
-        self.add_source_path(obj)
-        _dict[obj.slug] = obj
+          container.append(obj)
+          self.add_source_path(obj)
+          _dict[obj.slug] = obj
 
     # re-organize artists and collections - by slug
     self.songs.sort(key=lambda x: x.slug)
     for k in self.artists: k.songs.sort(key=lambda x: x.slug)
     for k in self.collections: k.songs.sort(key=lambda x: x.slug)
 
+    with self.instrument.span('thumbnails'):
+      self._make_thumbnails()
+
+    # parse and render songs, re-using results from previous runs where
+    # possible and parsing the remaining ones in parallel
+    with self.instrument.span('parse') as span:
+      self.parse_cache = ParseCache(self.settings,
+          self.settings.get('CHORDS_PARSE_CACHE',
+            _DEFAULT_SETTINGS['CHORDS_PARSE_CACHE']),
+          self.settings.get('CHORDS_PARSE_CACHE_SIZE',
+            _DEFAULT_SETTINGS['CHORDS_PARSE_CACHE_SIZE']))
+      self.parse_cache.load(self.songs,
+          self.settings.get('CHORDS_PARSE_WORKERS',
+            _DEFAULT_SETTINGS['CHORDS_PARSE_WORKERS']))
+      self.parse_cache.save_cache()
+      span.attributes.update(parsed=self.parse_cache.misses,
+          cached=self.parse_cache.hits)
+
     self._update_context(('artists', 'songs', 'collections'))
     self.save_cache()
     self.readers.save_cache()
     pelican.signals.page_generator_finalized.send(self)
 
 
+  def _make_thumbnails(self):
+    """Sets up copies of artist pictures scaled to the size they are shown
+
+    Pictures are only drawn 100 points high on PDFs, so full resolution ones
+    just bloat documents. Thumbnails are kept under ``CACHE_PATH``, named after
+    the contents of the original picture, so they are only re-made if it
+    changes. Thumbnails of pictures that are no longer used are removed.
+    Setting ``CHORDS_THUMBNAIL_HEIGHT`` to zero uses original pictures.
+    """
+
+    height = self.settings.get('CHORDS_THUMBNAIL_HEIGHT',
+        _DEFAULT_SETTINGS['CHORDS_THUMBNAIL_HEIGHT'])
+
+    if not height:
+      for k in self.artists: setattr(k, 'thumbnail_path', k.image_path)
+      return
+
+    directory = os.path.join(self.settings.get('CACHE_PATH', 'cache'),
+        'chords_thumbnails')
+    if not os.path.exists(directory): os.makedirs(directory)
+
+    thumbnails = {}
+    for k in sorted(set(k.image_path for k in self.artists)):
+      with open(k, 'rb') as f: digest = hashlib.sha1(f.read()).hexdigest()
+      thumbnails[k] = os.path.join(directory, '%s-%d.jpg' % (digest, height))
+
+    pending = [k for k in sorted(thumbnails) \
+        if not os.path.exists(thumbnails[k])]
+    workers = self.settings.get('CHORDS_LOAD_WORKERS',
+        _DEFAULT_SETTINGS['CHORDS_LOAD_WORKERS'])
+    with concurrent.futures.ThreadPoolExecutor(max(workers, 1)) as executor:
+      errors = executor.map(_make_thumbnail, pending,
+          [thumbnails[k] for k in pending], [height] * len(pending))
+      for k, error in zip(pending, errors):
+        if error is None: continue
+        logger.warning('Could not make a thumbnail of %s (%s), using it as is',
+            k, error)
+        thumbnails[k] = k
+
+    used = set(os.path.basename(k) for k in thumbnails.values())
+    for k in os.listdir(directory):
+      if k not in used: os.remove(os.path.join(directory, k))
+
+    for k in self.artists: setattr(k, 'thumbnail_path',
+        thumbnails[k.image_path])
+
+
+  def _build_digest(self):
+    """Returns a hash of everything that affects all outputs
+
+    This includes the plugin source code and all settings that can be
+    represented in JSON, except those in ``_EXECUTION_SETTINGS``, which do not
+    change outputs.
+    """
+
+    h = hashlib.sha1()
+
+    plugin = os.path.dirname(os.path.realpath(__file__))
+    for k in sorted(os.listdir(plugin)):
+      if k.endswith('.py'):
+        h.update(self.manifest.file_digest(os.path.join(plugin, k)).encode())
+
+    for key in sorted(self.settings):
+      if key in _EXECUTION_SETTINGS: continue
+      try:
+        h.update(json.dumps([key, self.settings[key]],
+          sort_keys=True).encode('utf-8'))
+      except (TypeError, ValueError):
+        pass #cannot be represented stably, ignore it
+
+    return h.hexdigest()
+
+
+  def _templates_digest(self):
+    """Returns a hash of all theme templates"""
+
+    h = hashlib.sha1()
+    templates = os.path.join(self.theme, 'templates')
+    for dirpath, dirs, files in os.walk(templates):
+      dirs.sort()
+      for k in sorted(files):
+        path = os.path.join(dirpath, k)
+        h.update(os.path.relpath(path, templates).encode('utf-8'))
+        h.update(self.manifest.file_digest(path).encode())
+    return h.hexdigest()
+
+
+  def _inputs(self, obj):
+    """Returns the paths of the files an object is made of"""
+
+    retval = [os.path.join(self.path, obj.source_path)]
+    if isinstance(obj, Artist):
+      retval.append(obj.image_path)
+    elif isinstance(obj, Song):
+      for artist in ('performer', 'composer'):
+        if hasattr(obj, artist): retval += self._inputs(getattr(obj, artist))
+    return retval
+
+
+  def _output_digest(self, kind, objects):
+    """Returns a hash of all inputs of an output made of the given objects"""
+
+    values = [self._digests[kind]]
+    for obj in objects:
+      for path in self._inputs(obj):
+        values += [path, self.manifest.file_digest(path)]
+    return self.manifest.digest(*values)
+
+
   def _generate_pdf(self):
-    """Generate pdf pages for specific entries"""
+    """Generate pdf pages for specific entries
 
-    import time
+    Documents are independent of each other and may be generated on a pool of
+    processes (see ``CHORDS_PDF_WORKERS``). Chordbooks are scheduled first,
+    largest first, so the site-wide one does not delay the end of the build.
+    If this phase is profiled (see ``CHORDS_PROFILE``), documents are generated
+    on this process instead, so they show up on profiles.
+    """
+
+    from .pdf import chordbook, song, clear_caches
 
-    from .pdf import chordbook, song
+    clear_caches()
 
     baseurl = self.settings.get('SITEURL', '/')
     output = self.settings.get('OUTPUT_PATH', 'output')
     author = self.settings.get('AUTHOR', 'Unknown Editor')
 
+    jobs = [] #(category, filename, digest, function, args)
+    urls = [] #(object, basename)
+    items = [] #(basename, item name), for each job
+    skipped = [] #basenames of up-to-date documents
+
+    def _add(category, basename, name, objects, function, *args):
+      filename = os.path.join(output, basename)
+      dirname = os.path.dirname(filename)
+      if not os.path.exists(dirname): os.makedirs(dirname)
+      digest = self._output_digest('pdf', objects)
+      if not self.manifest.up_to_date(filename, digest):
+        jobs.append((category, filename, digest, function, (filename,) + args))
+        items.append((basename, name))
+      else:
+        skipped.append(basename)
+
     # all chords
-    start = time.time()
     basename = self.settings.get('CHORDBOOK_PDF_SAVE_AS', 'pdfs/chordbook.pdf')
-    filename = os.path.join(output, basename)
-    dirname = os.path.dirname(filename)
-    if not os.path.exists(dirname): os.makedirs(dirname)
-
-    doc = chordbook(filename, self.songs, 'Cifras por', author,
-        '/'.join((baseurl, basename)), self.settings)
-    print('Done: Chords plug-in processed site-wide PDF in {:.2f} ' \
-        'seconds'.format(time.time()-start))
+    _add('site-wide', basename, basename, self.songs, chordbook, self.songs,
+        'Cifras por', author, '/'.join((baseurl, basename)), self.settings)
 
     # per artist
-    start = time.time()
     for k in self.artists:
       if len(k.songs) == 0:
         print('Skip: Chords plug-in skipped artist %s - no songs' % k.slug)
@@ -175,30 +490,19 @@ class Generator(pelican.generators.CachingGenerator):
       basename = self.settings.get('ARTIST_PDF_SAVE_AS',
           'pdfs/artists/{slug}.pdf')
       basename = basename.format(slug=k.slug)
-      filename = os.path.join(output, basename)
-      dirname = os.path.dirname(filename)
-      if not os.path.exists(dirname): os.makedirs(dirname)
-      doc = chordbook(filename, k.songs, 'Cifras de %s' % k.name,
-          'por %s' % author, '/'.join((baseurl, basename)), self.settings)
-      setattr(k, 'pdf_url', basename)
-    print('Done: Chords plug-in processed {} artist PDFs in {:.2f} ' \
-        'seconds'.format(len(self.artists), time.time()-start))
+      _add('artist', basename, k.slug, [k] + k.songs, chordbook, k.songs,
+          'Cifras de %s' % k.name, 'por %s' % author,
+          '/'.join((baseurl, basename)), self.settings)
+      urls.append((k, basename))
 
     # per song
-    start = time.time()
     for k in self.songs:
       basename = self.settings.get('SONG_PDF_SAVE_AS', 'pdfs/songs/{slug}.pdf')
       basename = basename.format(slug=k.slug)
-      filename = os.path.join(output, basename)
-      dirname = os.path.dirname(filename)
-      if not os.path.exists(dirname): os.makedirs(dirname)
-      doc = song(filename, k, self.settings)
-      setattr(k, 'pdf_url', basename)
-    print('Done: Chords plug-in processed {} song PDFs in {:.2f} ' \
-        'seconds'.format(len(self.songs), time.time()-start))
+      _add('song', basename, k.slug, [k], song, k, self.settings)
+      urls.append((k, basename))
 
     # per collection
-    start = time.time()
     for k in self.collections:
       if len(k.songs) == 0:
         print('Skip: Chords plug-in skipped collection %s - no songs' % k.slug)
@@ -206,14 +510,87 @@ class Generator(pelican.generators.CachingGenerator):
       basename = self.settings.get('COLLECTION_PDF_SAVE_AS',
           'pdfs/collections/{slug}.pdf')
       basename = basename.format(slug=k.slug)
+      _add('collection', basename, k.slug, [k] + k.songs, chordbook, k.songs,
+          'Cifras da Coletânea %s' % k.title, 'por %s' % author,
+          '/'.join((baseurl, basename)), self.settings)
+      urls.append((k, basename))
+
+    # schedule chordbooks first, largest first, then songs
+    order = sorted(range(len(jobs)), key=lambda i: \
+        -len(jobs[i][4][1]) if jobs[i][3] is chordbook else 0)
+    workers = self.settings.get('CHORDS_PDF_WORKERS',
+        _DEFAULT_SETTINGS['CHORDS_PDF_WORKERS'])
+    if self.instrument.profiling('pdf'): workers = 1
+    timings = _run_pdf_jobs([jobs[i][3:] for i in order], workers)
+    timings = dict(zip(order, timings))
+
+    # only now we can update the objects and the manifest
+    for k, basename in urls: setattr(k, 'pdf_url', basename)
+    for category, filename, digest, function, args in jobs:
+      self.manifest.record(filename, digest)
+
+    # songs may have been laid out by any (or many) of the documents
+    layouts = {}
+    for k in timings.values():
+      for slug, seconds in k[5].items():
+        layouts[slug] = layouts.get(slug, 0.) + seconds
+    for k in self.songs:
+      self.instrument.cost('song', k.slug, parse=k.parse_time,
+          layout=layouts.get(k.slug))
+
+    # skipped documents and songs loaded from the parse cache are not measured
+    if skipped:
+      self.instrument.partial.append('{} PDFs skipped'.format(len(skipped)))
+    cached = len([k for k in self.songs if k.parse_time is None])
+    if cached:
+      self.instrument.partial.append('{} songs loaded from the parse ' \
+          'cache'.format(cached))
+
+    # documents may have run interleaved on workers: categories span from the
+    # start of their first document to the end of their last one, which may
+    # include documents of other categories. The time spent on the documents
+    # of each category is reported separately.
+    for category in ('site-wide', 'artist', 'song', 'collection'):
+      t = [i for i, k in enumerate(jobs) if k[0] == category]
+      if not t:
+        print('Done: Chords plug-in processed 0 {} PDFs'.format(category))
+        continue
+      name = 'pdf.%s' % category
+      rss = [timings[i][3] for i in t if timings[i][3] is not None]
+      documents_wall = sum(timings[i][1] - timings[i][0] for i in t)
+      span = self.instrument.add(name, min(timings[i][0] for i in t),
+          max(timings[i][1] for i in t), sum(timings[i][2] for i in t),
+          max(rss) if rss else None, documents=len(t),
+          documents_wall=documents_wall)
+      for i in t:
+        self.instrument.add('pdf.document', *timings[i][:4], parent=name,
+            category=category, file=items[i][0])
+        self.instrument.cost(category, items[i][1], time=timings[i][1] - \
+            timings[i][0], pages=timings[i][4],
+            bytes=os.path.getsize(jobs[i][1]))
+      print('Done: Chords plug-in processed {} {} PDFs in {:.2f} seconds ' \
+          'of documents ({:.2f} seconds of CPU, {:.2f} seconds elapsed from ' \
+          'first to last)'.format(len(t), category, documents_wall, span.cpu,
+            span.wall))
+
+
+  def _generate_images(self):
+    """Copies artist thumbnails to the output, so pages can show them"""
+
+    output = self.settings.get('OUTPUT_PATH', 'output')
+
+    for k in self.artists:
+      basename = self.settings.get('ARTIST_IMAGE_SAVE_AS',
+          'images/artists/{slug}.jpg')
+      basename = basename.format(slug=k.slug)
       filename = os.path.join(output, basename)
-      dirname = os.path.dirname(filename)
-      if not os.path.exists(dirname): os.makedirs(dirname)
-      doc = chordbook(filename, k.songs, 'Cifras da Coletânea %s' % k.title,
-          'por %s' % author, '/'.join((baseurl, basename)), self.settings)
-      setattr(k, 'pdf_url', basename)
-    print('Done: Chords plug-in processed {} collection PDFs in {:.2f} ' \
-        'seconds'.format(len(self.collections), time.time()-start))
+      digest = self.manifest.file_digest(k.thumbnail_path)
+      if not self.manifest.up_to_date(filename, digest):
+        dirname = os.path.dirname(filename)
+        if not os.path.exists(dirname): os.makedirs(dirname)
+        shutil.copyfile(k.thumbnail_path, filename)
+        self.manifest.record(filename, digest)
+      setattr(k, 'image_url', basename)
 
 
   def _generate_indexes(self, writer):
@@ -239,14 +616,21 @@ class Generator(pelican.generators.CachingGenerator):
 
     This method will respect user settings for the location of pages. The name
     of templates is taken from the corresponding class static variables.
+    Pages whose inputs did not change since the last build are not re-written.
     """
 
+    output = self.settings.get('OUTPUT_PATH', 'output')
+
     # writes specific
     for obj in itertools.chain(self.artists, self.songs, self.collections):
       if isinstance(obj, (Artist, Collection)) and not obj.songs:
         print('Skip: Chords plug-in skipped %s %s - no songs' % \
             (obj.__class__.__name__.lower(), obj.slug))
         continue
+      filename = os.path.join(output, obj.save_as)
+      objects = [obj] if isinstance(obj, Song) else [obj] + obj.songs
+      digest = self._output_digest('html', objects)
+      if self.manifest.up_to_date(filename, digest): continue
       writer.write_file(
           obj.save_as,
           self.get_template(obj.template),
@@ -255,15 +639,92 @@ class Generator(pelican.generators.CachingGenerator):
           relative_urls=self.settings['RELATIVE_URLS'],
           override_output=hasattr(obj, 'override_save_as'),
           )
+      self.manifest.record(filename, digest)
       pelican.signals.page_writer_finalized.send(self, writer=writer)
 
 
   def generate_output(self, writer):
     """Called by pelican as part of the generator interface
 
-    Should trigger the generation of all required documents.
+    Should trigger the generation of all required documents. Outputs which
+    inputs did not change since the last build are skipped, see
+    :py:class:`.cache.BuildManifest`. The timings of each phase of the build
+    are saved to ``CHORDS_BUILD_REPORT`` (under ``CACHE_PATH``), see
+    :py:mod:`.instrument`.
+    """
+
+    self.manifest = BuildManifest(self.settings,
+        self.settings.get('CHORDS_INCREMENTAL',
+          _DEFAULT_SETTINGS['CHORDS_INCREMENTAL']))
+    build = self._build_digest()
+    self._digests = {
+        'pdf': build,
+        'html': self.manifest.digest(build, self._templates_digest()),
+        }
+
+    #these have to come first so image_urls and pdf_urls are set
+    with self.instrument.span('images'):
+      self._generate_images()
+    with self.instrument.span('pdf'):
+      self._generate_pdf()
+    with self.instrument.span('html'):
+      self._generate_objects(writer)
+    with self.instrument.span('indexes'):
+      self._generate_indexes(writer)
+    self.manifest.save_cache()
+    print('Done: Chords plug-in {}'.format(self.manifest))
+    print('Done: Chords plug-in parsed {} songs {} times'.format(
+      len(self.songs), Song.parse_count))
+
+    self._report()
+
+
+  def _report(self):
+    """Reports the most costly items of the build and regressions
+
+    Items are compared to the ones on the build report at
+    ``CHORDS_BUILD_BASELINE``, if set. A warning is logged if that report is
+    partial, as items it did not measure cannot be compared. Regressions beyond
+    ``CHORDS_REGRESSION_THRESHOLD`` are logged as warnings, followed by an
+    error, so running pelican with ``--fatal errors`` fails on them. The
+    report of this build is saved beforehand to ``CHORDS_BUILD_REPORT``, under
+    ``CACHE_PATH``.
     """
 
-    self._generate_pdf() #this has to come first so pdf_urls are set
-    self._generate_objects(writer)
-    self._generate_indexes(writer)
+    n = self.settings.get('CHORDS_REPORT_TOP',
+        _DEFAULT_SETTINGS['CHORDS_REPORT_TOP'])
+    for k in instrument.summary(self.instrument.items, n):
+      print('Done: Chords plug-in {}'.format(k))
+
+    report = self.settings.get('CHORDS_BUILD_REPORT',
+        _DEFAULT_SETTINGS['CHORDS_BUILD_REPORT'])
+    if report:
+      report = os.path.join(self.settings.get('CACHE_PATH', 'cache'), report)
+      self.instrument.save(report)
+      print('Done: Chords plug-in saved build report at {}'.format(report))
+
+    baseline = self.settings.get('CHORDS_BUILD_BASELINE',
+        _DEFAULT_SETTINGS['CHORDS_BUILD_BASELINE'])
+    if baseline:
+      threshold = self.settings.get('CHORDS_REGRESSION_THRESHOLD',
+          _DEFAULT_SETTINGS['CHORDS_REGRESSION_THRESHOLD'])
+      path = baseline
+      try:
+        baseline = instrument.load(path)
+      except Exception as e:
+        logger.error('Could not load build baseline %s\n%s', path, e)
+        baseline = dict(items=[])
+      if baseline.get('partial'):
+        logger.warning('Chords plug-in: build baseline %s is partial (%s), ' \
+            'items it did not measure are not compared', path,
+            ', '.join(baseline['partial']))
+      regressions = instrument.regressions(self.instrument.items,
+          baseline['items'], threshold)
+      for item, metric, previous, current in regressions:
+        fmt = instrument.METRICS[metric][1]
+        logger.warning('Chords plug-in: %s %s regressed on %s, from %s to %s',
+            item['kind'], item['name'], metric, fmt.format(previous),
+            fmt.format(current))
+      if regressions:
+        logger.error('Chords plug-in: %d items regressed beyond %d%%',
+            len(regressions), round(100 * threshold))
@@ -0,0 +1,427 @@
+#!/usr/bin/env python
+# vim: set fileencoding=utf-8 :
+
+'''Build instrumentation for the chords plugin
+
+Phases of the build are timed as named spans, using monotonic clocks. Each
+span records its wall-clock and CPU times, and its peak resident set size (see
+:py:func:`peak_rss`). Spans measured on worker processes (e.g. PDF
+documents) are added once those finish; the CPU time of a span does not
+include that of workers it waited for. The cost of individual items (songs and
+chordbooks) is recorded along, so slow or large ones can be singled out and
+compared to the ones of a previous build. Top-level spans may also be
+profiled, see :py:meth:`Recorder.profile`.
+
+Spans and items are saved to a JSON build report. Spans are also announced
+through signals, so other plugins may subscribe to them, e.g.::
+
+  from chords.instrument import span_finished
+
+  def _print(sender, span):
+    print(span.name, span.wall)
+
+  span_finished.connect(_print)
+'''
+
+import os
+import sys
+import time
+import json
+import cProfile
+import datetime
+import contextlib
+import tracemalloc
+
+try:
+  import resource
+except ImportError: #not available on Windows
+  resource = None
+
+from blinker import signal
+
+
+span_started = signal('chords_span_started')
+'''Sent with the keyword argument ``span``, as spans start'''
+
+span_finished = signal('chords_span_finished')
+'''Sent with the keyword argument ``span``, once spans are measured'''
+
+
+METRICS = dict(
+    parse=('slowest parses', '{:.3f}s', 0.005),
+    layout=('slowest layouts', '{:.3f}s', 0.025),
+    time=('slowest PDFs', '{:.3f}s', 0.1),
+    pages=('longest PDFs', '{} pages', 0),
+    bytes=('largest PDFs', '{:,} bytes', 1024),
+    )
+"""Item metrics: their description, format and the smallest (absolute)
+difference between builds that is not considered noise"""
+
+
+PROFILERS = dict(cprofile='pstats', tracemalloc='tracemalloc')
+"""Available profilers and the extensions of the files they dump"""
+
+
+# Spans being measured on this process. Their peak resident set size so far is
+# kept on them whenever the peak of the process is reset.
+_measuring = []
+
+
+def peak_rss():
+  '''Returns the peak resident set size of this process, in bytes
+
+  On Linux, this is the peak since the last call to :py:func:`reset_peak_rss`
+  (``VmHWM``), if any. Elsewhere, it is the peak since the process started.
+  Returns ``None`` if that cannot be measured on this platform.
+  '''
+
+  try:
+    with open('/proc/self/status', 'rt') as f:
+      for line in f:
+        if line.startswith('VmHWM:'): return int(line.split()[1]) * 1024
+  except (OSError, ValueError):
+    pass #not Linux, falls back to getrusage()
+
+  if resource is None: return None
+  rss = resource.getrusage(resource.RUSAGE_SELF).ru_maxrss
+  return rss if sys.platform == 'darwin' else rss * 1024 #kilobytes on Linux
+
+
+def reset_peak_rss():
+  '''Resets the peak resident set size of this process to its current size
+
+  This is only possible on Linux, by writing ``5`` to
+  ``/proc/self/clear_refs``. The peak so far is first kept on the spans being
+  measured, so resets do not hide it from them.
+
+
+  Returns:
+
+    bool: ``True`` if the peak was reset, ``False`` if that is not possible
+
+  '''
+
+  peak = peak_rss()
+  if peak is not None:
+    for k in _measuring: k.rss = max(k.rss or 0, peak)
+
+  try:
+    with open('/proc/self/clear_refs', 'wt') as f: f.write('5')
+  except OSError:
+    return False
+  return True
+
+
+class Span(object):
+  '''A named phase of the build
+
+
+  Parameters:
+
+    name (str): The name of this span, e.g. ``parse`` or ``pdf.song``
+
+    parent (str): The name of the span enclosing this one, or ``None``
+
+    attributes (dict): Additional (JSON serializable) values describing the
+      span, e.g. the file being produced
+
+  '''
+
+  def __init__(self, name, parent=None, **attributes):
+    self.name = name
+    self.parent = parent
+    self.attributes = attributes
+    self.start = None #seconds since the recorder started
+    self.wall = None
+    self.cpu = None
+    self.rss = None #peak resident set size, in bytes, see Recorder
+
+
+  def as_dict(self):
+    '''Returns this span as a dictionary, for the build report'''
+
+    return dict(name=self.name, parent=self.parent, start=self.start,
+        wall=self.wall, cpu=self.cpu, rss=self.rss, attributes=self.attributes)
+
+
+class Recorder(object):
+  '''Records the spans of a build
+
+  Spans are either measured on this process, with :py:meth:`span`, or
+  measured elsewhere (e.g. on worker processes) and added with
+  :py:meth:`add`.
+
+  Where the peak resident set size of the process can be reset (see
+  :py:func:`reset_peak_rss`), it is reset as each span starts, and spans
+  record their own peak. Otherwise, they record the peak of the process up to
+  their end. :py:attr:`rss_per_span` tells which, and is saved on the report.
+
+
+  Parameters:
+
+    sender (object): The object sending span signals, e.g. the generator
+
+  '''
+
+  def __init__(self, sender=None):
+    self.sender = sender
+    self.origin = time.monotonic()
+    self.rss_per_span = reset_peak_rss()
+    self.spans = []
+    self.items = []
+    self.partial = [] #why items may be missing metrics, e.g. skipped outputs
+    self._items = {}
+    self._stack = []
+    self.profiler = None
+    self.profiled = None
+    self.directory = None
+
+
+  def profile(self, spec, directory):
+    '''Sets up profiling of top-level spans
+
+    Each profiled span dumps a file named after it in ``directory``: cProfile
+    statistics (``<span>.pstats``) or a tracemalloc snapshot
+    (``<span>.tracemalloc``). Only spans with no parent are profiled, so
+    profilers never nest.
+
+
+    Parameters:
+
+      spec (str): The profiler to use (see :py:data:`PROFILERS`), optionally
+        followed by a colon and a comma-separated list of span names, e.g.
+        ``cprofile:pdf,html``. If no spans are listed, all are profiled
+
+      directory (str): Where to dump profiles
+
+
+    Raises:
+
+      ValueError: if the profiler is not known
+
+    '''
+
+    profiler, _, names = spec.partition(':')
+    if profiler not in PROFILERS:
+      raise ValueError('unknown profiler %r, choose one of %s' % (profiler,
+        ', '.join(sorted(PROFILERS))))
+    self.profiler = profiler
+    self.profiled = set(k.strip() for k in names.split(',') if k.strip()) \
+        or None
+    self.directory = directory
+
+
+  def profiling(self, name):
+    '''Tells if a top-level span with the given name is profiled'''
+
+    return self.profiler is not None and \
+        (self.profiled is None or name in self.profiled)
+
+
+  @contextlib.contextmanager
+  def _profile(self, name):
+    '''Runs a profiler, if spans with the given name are profiled'''
+
+    if self._stack or not self.profiling(name):
+      yield
+      return
+
+    if not os.path.exists(self.directory): os.makedirs(self.directory)
+    path = os.path.join(self.directory, '%s.%s' % (name,
+      PROFILERS[self.profiler]))
+
+    if self.profiler == 'cprofile':
+      profile = cProfile.Profile()
+      profile.enable()
+      try:
+        yield
+      finally:
+        profile.disable()
+        profile.dump_stats(path)
+
+    else: #tracemalloc
+      tracemalloc.start(10)
+      try:
+        yield
+      finally:
+        tracemalloc.take_snapshot().dump(path)
+        tracemalloc.stop()
+
+
+  @contextlib.contextmanager
+  def span(self, name, **attributes):
+    '''Measures the code under a ``with`` statement as a span
+
+    Spans opened under this one become its children. Yields the span, so
+    attributes may still be added to it. Top-level spans may be profiled, see
+    :py:meth:`profile`.
+    '''
+
+    span = Span(name, self._stack[-1].name if self._stack else None,
+        **attributes)
+
+    with self._profile(name):
+      self.spans.append(span)
+      self._stack.append(span)
+      span_started.send(self.sender, span=span)
+
+      if self.rss_per_span: reset_peak_rss()
+      _measuring.append(span)
+      start = time.monotonic()
+      cpu = time.process_time()
+      try:
+        yield span
+      finally:
+        span.start = start - self.origin
+        span.wall = time.monotonic() - start
+        span.cpu = time.process_time() - cpu
+        peak = peak_rss()
+        span.rss = None if peak is None else max(span.rss or 0, peak)
+        _measuring.remove(span)
+        self._stack.pop()
+        span_finished.send(self.sender, span=span)
+
+
+  def add(self, name, start, end, cpu, rss, parent=None, **attributes):
+    '''Adds a span that was measured elsewhere
+
+    Only :py:data:`span_finished` is sent for such spans.
+
+
+    Parameters:
+
+      name (str): The name of the span
+
+      start (float): The start time, as returned by :py:func:`time.monotonic`
+
+      end (float): The end time, as returned by :py:func:`time.monotonic`
+
+      cpu (float): The CPU time spent, in seconds
+
+      rss (int): The peak resident set size, in bytes, or ``None``
+
+      parent (str): The name of the enclosing span. If not set, the span
+        currently open on this recorder, if any
+
+      attributes (dict): Additional values describing the span
+
+    '''
+
+    if parent is None and self._stack: parent = self._stack[-1].name
+    span = Span(name, parent, **attributes)
+    span.start = start - self.origin
+    span.wall = end - start
+    span.cpu = cpu
+    span.rss = rss
+    self.spans.append(span)
+    span_finished.send(self.sender, span=span)
+    return span
+
+
+  def cost(self, kind, name, **metrics):
+    '''Records metrics of an item, e.g. the time it took to parse a song
+
+    Metrics set to ``None`` are not recorded.
+
+
+    Parameters:
+
+      kind (str): The kind of item, e.g. ``song`` or ``artist``
+
+      name (str): The name of the item, unique for its kind
+
+      metrics (dict): Values for any of :py:data:`METRICS`
+
+    '''
+
+    key = (kind, name)
+    if key not in self._items:
+      self._items[key] = dict(kind=kind, name=name)
+      self.items.append(self._items[key])
+    self._items[key].update((k, v) for k, v in metrics.items() \
+        if v is not None)
+
+
+  def report(self):
+    '''Returns the build report, as a dictionary'''
+
+    return dict(
+        date=datetime.datetime.now().isoformat(),
+        python=sys.version.split()[0],
+        rss_per_span=self.rss_per_span,
+        partial=self.partial,
+        spans=[k.as_dict() for k in self.spans],
+        items=self.items,
+        )
+
+
+  def save(self, path):
+    '''Saves the build report as JSON'''
+
+    dirname = os.path.dirname(path)
+    if dirname and not os.path.exists(dirname): os.makedirs(dirname)
+    with open(path, 'wt') as f:
+      json.dump(self.report(), f, indent=2)
+
+
+def load(path):
+  '''Loads a build report saved with :py:meth:`Recorder.save`'''
+
+  with open(path, 'rt') as f:
+    return json.load(f)
+
+
+def top(items, metric, n):
+  '''Returns the ``n`` items with the largest values for a metric'''
+
+  items = [k for k in items if k.get(metric) is not None]
+  return sorted(items, key=lambda k: k[metric], reverse=True)[:n]
+
+
+def summary(items, n):
+  '''Returns lines describing the top ``n`` items for each metric'''
+
+  retval = []
+  for metric, (description, fmt, noise) in METRICS.items():
+    values = ['{} {} ({})'.format(k['kind'], k['name'],
+      fmt.format(k[metric])) for k in top(items, metric, n)]
+    if values: retval.append('{}: {}'.format(description, ', '.join(values)))
+  return retval
+
+
+def regressions(items, baseline, threshold):
+  '''Compares items to the ones of a previous build
+
+  An item regressed on a metric if its value grew by more than ``threshold``
+  (relative to the baseline) and by more than the noise level of the metric
+  (see :py:data:`METRICS`). Items or metrics missing in either build are not
+  compared.
+
+
+  Parameters:
+
+    items (list): Items of the current build, as in :py:attr:`Recorder.items`
+
+    baseline (list): Items of a previous build
+
+    threshold (float): The relative growth tolerated, e.g. ``0.2`` for 20%
+
+
+  Returns:
+
+    list: ``(item, metric, previous, current)`` tuples, for each regression
+
+  '''
+
+  previous = dict(((k['kind'], k['name']), k) for k in baseline)
+
+  retval = []
+  for item in items:
+    old = previous.get((item['kind'], item['name']))
+    if old is None: continue
+    for metric, (description, fmt, noise) in METRICS.items():
+      if item.get(metric) is None or old.get(metric) is None: continue
+      if item[metric] > old[metric] * (1 + threshold) and \
+          item[metric] - old[metric] > noise:
+        retval.append((item, metric, old[metric], item[metric]))
+  return retval
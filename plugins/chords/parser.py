@@ -4,43 +4,116 @@
 """A simple parser for Chord Pro files.
 """
 
+import os
 import re
-import codecs
+import sys
+import time
+import collections
+import concurrent.futures
 
 from . import pdf
 
 
-def break_line(v, width):
-  """Breaks the line trying to respect the given width. Returns a tuple."""
+def scan_chords(v):
+  """Separates lyrics and chords of a line in a single pass.
+
+  Chords are written within square brackets, in the middle of the lyrics.
+  Returns a tuple with the bare lyrics (chords removed) and a tuple of
+  ``(offset, name)`` tuples, one per chord. The offset of each chord is the
+  number of spaces to print between the end of the previous chord name (or
+  the start of the line) and the chord itself, so that it lands over the
+  right syllable. Subsequent chords are always separated by at least one
+  space. If the line has no chords, the second tuple is empty.
+  """
+
+  pieces = []
+  chords = []
+  position = 0 #position on the input
+  length = 0 #length of the bare lyrics so far
+  last = 0 #position where the previous chord name ends, when printed
+  while True:
+    start = v.find(u'[', position)
+    if start < 0: break
+    end = v.find(u']', start+1)
+    if end < 0: break
+    pieces.append(v[position:start])
+    length += start - position
+    name = sys.intern(v[start+1:end])
+    offset = length - last
+    if chords and offset <= 0: offset = 1
+    chords.append((offset, name))
+    last = length + len(name)
+    position = end + 1
+
+  if not chords: return v, ()
+  pieces.append(v[position:])
+  return u''.join(pieces), tuple(chords)
+
+
+def _break(words, lengths, width):
+  """Breaks a sequence of words into lines, trying to respect the given width.
+  ``lengths`` contains the printed length of each word, so lines are built in
+  a single pass, without re-measuring the accumulated text."""
+
   retval = []
-  for k in v.split(u' '):
+  for k, length in zip(words, lengths):
     if not retval:
-      retval.append(k)
+      retval.append([k])
+      current = length
       continue
 
     #when you get here, retval is filled with at least one entry
 
     #adds the space we splitted before
-    if len(retval[-1]) < width: retval[-1] += u' '
-    else: retval.append(u' ')
+    if current < width:
+      retval[-1].append(u' ')
+      current += 1
+    else:
+      retval.append([u' '])
+      current = 1
 
     #adds the next word
-    if len(retval[-1]) + len(k) <= width: retval[-1] += k
-    else: retval.append(k)
+    if current + length <= width:
+      retval[-1].append(k)
+      current += length
+    else:
+      retval.append([k])
+      current = length
 
-  return [k.strip() for k in retval if k.strip()]
+  retval = [u''.join(k).strip() for k in retval]
+  return [k for k in retval if k]
+
+
+def break_line(v, width):
+  """Breaks the line trying to respect the given width. Returns a tuple."""
+  words = v.split(u' ')
+  return _break(words, [len(k) for k in words], width)
 
 
 def break_chordline(v, width):
   """Does about the same as break_line() above, but breaks the chord lines in
   respecting chord positions relative to the lyrics lines."""
 
+  words = v.split(u' ')
+  bare = [scan_chords(k)[0] if u'[' in k else k for k in words]
+
+  if any(u'[' in k for k in bare):
+    # a chord is split by a space, so chords cannot be measured word by word
+    return _break_chordline_slow(words, width)
+
+  return _break(words, [len(k) for k in bare], width)
+
+
+def _break_chordline_slow(words, width):
+  """Breaks chord lines by re-measuring the accumulated line for every word.
+  Only used for lines where a chord is split by a space."""
+
   def clen(v):
     """Calculates the length of v removing the chord entries."""
-    return len(LineParser.chord.sub('', v, re.UNICODE))
+    return len(scan_chords(v)[0])
 
   retval = []
-  for k in v.split(u' '):
+  for k in words:
     if not retval:
       retval.append(k)
       continue
@@ -58,9 +131,23 @@ def break_chordline(v, width):
   return [k.strip() for k in retval if k.strip()]
 
 
+def render_html(items):
+  """Renders items as an HTML fragment
+
+  Items append the pieces of their HTML to a single list (see their
+  ``html_parts()`` methods), which is joined once at the end.
+  """
+
+  out = []
+  for k in items: k.html_parts(out)
+  return u''.join(out)
+
+
 class Line:
   """A line that contains information of some sort."""
 
+  __slots__ = ('lineno', 'value')
+
   def __init__(self, v, lineno):
     self.lineno = lineno
     self.value = v
@@ -68,8 +155,11 @@ class Line:
   def __str__(self):
     return '%03d %s' % (self.lineno, self.value)
 
+  def html_parts(self, out):
+    out += (u'<span class="line">', self.value, u'</span>')
+
   def as_html(self):
-    return u'<span class="line">%s</span>' % self.value
+    return render_html([self])
 
   def as_pdf(self, width):
     """A normal line just returns itself as PDF"""
@@ -77,29 +167,26 @@ class Line:
 
 
 class ChordLine(Line):
-  """A special category of line that contains chords."""
+  """A special category of line that contains chords.
 
+  Chords are kept as a tuple of ``(offset, name)`` tuples, with interned chord
+  names, so repeated chords along the song share the same string.
+  """
 
-  def __init__(self, v, lineno):
+  __slots__ = ('bare', 'chords')
+
+  def __init__(self, v, lineno, scanned=None):
     Line.__init__(self, v, lineno)
-    self.bare, self.chords = self.real_init([self.value])
-    self.bare = self.bare[0]
-    self.chords = self.chords[0]
+    self.bare, self.chords = scanned or scan_chords(v)
 
 
   def real_init(self, value):
-    bare = [LineParser.chord.sub('', k, re.UNICODE) for k in value]
+    bare = []
     chords = []
     for k in value:
-      subtract = 0
-      to_append = []
-      for z in LineParser.chord.finditer(k):
-        to_append.append((z.start()-subtract, z.groups()[0]))
-        subtract = z.end() + (z.end() - z.start()) - 2
-      for i, c in enumerate(to_append[1:]):
-        # make sure the chords have at least 1 space between them.
-        if c[0] <= 0: to_append[i+1] = (1, c[1])
-      chords.append(to_append)
+      b, c = scan_chords(k)
+      bare.append(b)
+      chords.append(c)
     return bare, chords
 
 
@@ -110,12 +197,14 @@ class ChordLine(Line):
     return '\n'.join(v)
 
 
+  def html_parts(self, out):
+    out.append(u'<span class="chords">')
+    for offset, name in self.chords: out += (u' ' * offset, name)
+    out += (u'</span>\n<span class="lyrics">', self.bare, u'</span>\n')
+
+
   def as_html(self):
-    cline = ''
-    for c in self.chords: cline += (' '*c[0] + c[1])
-    v = u'<span class="chords">%s</span>\n' % cline
-    v += u'<span class="lyrics">%s</span>\n' % self.bare
-    return v
+    return render_html([self])
 
 
   def as_pdf(self, width):
@@ -138,6 +227,8 @@ class ChordLine(Line):
 class EmptyLine:
   """A line with nothing."""
 
+  __slots__ = ('lineno',)
+
 
   def __init__(self, lineno):
     self.lineno = lineno
@@ -147,21 +238,33 @@ class EmptyLine:
     return '%03d ' % (self.lineno,)
 
 
+  def html_parts(self, out):
+    out.append(u'\n')
+
+
   def as_html(self):
-    return u'\n'
+    return render_html([self])
 
 
   def as_pdf(self, width):
     return [u'']
 
 
+  def as_block(self, width):
+    """Returns the style name and text of the PDF block for this item"""
+    return ('verse', u'<br/>')
+
+
   def as_flowable(self, width):
-    return pdf.XPreformatted(u'<br/>', pdf.style['verse'])
+    style, text = self.as_block(width)
+    return pdf.Block(text, pdf.style[style])
 
 
 class HashComment(EmptyLine):
   """A hash comment is a line that starts with a # mark."""
 
+  __slots__ = ('comment',)
+
 
   def __init__(self, v, lineno):
     EmptyLine.__init__(self, lineno)
@@ -172,8 +275,12 @@ class HashComment(EmptyLine):
     return '%03d %s' % (self.lineno, self.comment)
 
 
+  def html_parts(self, out):
+    #out += (u'<span class="hashcomment">', self.comment, u'</span>\n')
+    pass
+
+
   def as_html(self):
-    #v = u'<span class="hashcomment">%s</span>\n' % self.comment
     return u''
 
 
@@ -181,6 +288,10 @@ class HashComment(EmptyLine):
     return break_line(self.comment, width)
 
 
+  def as_block(self, width):
+    return None
+
+
   def as_flowable(self, width):
     return None
 
@@ -188,6 +299,10 @@ class HashComment(EmptyLine):
 class Verse:
   """A verse."""
 
+  __slots__ = ('lines', 'ended')
+
+  pdf_style = 'verse'
+
 
   def __init__(self):
     self.lines = []
@@ -213,19 +328,35 @@ class Verse:
     return u'\n'.join(v)
 
 
+  def html_parts(self, out):
+    for i, k in enumerate(self.lines):
+      if i: out.append(u'\n')
+      k.html_parts(out)
+
+
   def as_html(self):
-    return u'\n'.join([k.as_html() for k in self.lines])
+    return render_html([self])
 
 
-  def as_flowable(self, width):
+  def as_block(self, width):
+    """Returns the style name and text of the PDF block for this item"""
     data = []
     for k in self.lines: data += k.as_pdf(width)
-    return pdf.XPreformatted('\n'.join(data), pdf.style['verse'])
+    return (self.pdf_style, '\n'.join(data))
+
+
+  def as_flowable(self, width):
+    style, text = self.as_block(width)
+    return pdf.Block(text, pdf.style[style])
 
 
 class Chorus(Verse):
   """A complete chorus entry."""
 
+  __slots__ = ('starts', 'ends')
+
+  pdf_style = 'chorus'
+
 
   def __init__(self, start):
     Verse.__init__(self)
@@ -251,22 +382,19 @@ class Chorus(Verse):
     return '\n'.join([str(k) for k in v])
 
 
-  def as_html(self):
-    v = u'<span class="chorus">'
-    v += u'\n'.join([k.as_html() for k in self.lines])
-    v += u'</span>'
-    return u'\n' + v + u'\n'
-
-
-  def as_flowable(self, width):
-    data = []
-    for k in self.lines: data += k.as_pdf(width)
-    return pdf.XPreformatted('\n'.join(data), pdf.style['chorus'])
+  def html_parts(self, out):
+    out.append(u'\n<span class="chorus">')
+    Verse.html_parts(self, out)
+    out.append(u'</span>\n')
 
 
 class Tablature(Verse):
   """A complete tablature entry."""
 
+  __slots__ = ('starts', 'ends')
+
+  pdf_style = 'tablature'
+
 
   def __init__(self, start):
     Verse.__init__(self)
@@ -292,22 +420,17 @@ class Tablature(Verse):
     return '\n'.join([str(k) for k in v])
 
 
-  def as_html(self):
-    v = u'<span class="tablature">'
-    v += u'\n'.join([k.as_html() for k in self.lines])
-    v += u'</span>'
-    return u'\n' + v + u'\n'
-
-
-  def as_flowable(self, width):
-    data = []
-    for k in self.lines: data += k.as_pdf(width)
-    return pdf.XPreformatted('\n'.join(data), pdf.style['tablature'])
+  def html_parts(self, out):
+    out.append(u'\n<span class="tablature">')
+    Verse.html_parts(self, out)
+    out.append(u'</span>\n')
 
 
 class Command:
   """A generic command from chordpro."""
 
+  __slots__ = ('lineno',)
+
 
   def __init__(self, lineno):
     self.lineno = lineno
@@ -317,6 +440,10 @@ class Command:
     return []
 
 
+  def as_block(self, width):
+    return None
+
+
   def as_flowable(self, width):
     return None
 
@@ -324,6 +451,8 @@ class Command:
 class StartOfChorus(Command):
   """A start of chorus marker."""
 
+  __slots__ = ()
+
   def __init__(self, lineno):
     Command.__init__(self, lineno)
 
@@ -335,6 +464,8 @@ class StartOfChorus(Command):
 class EndOfChorus(Command):
   """A end of chorus marker."""
 
+  __slots__ = ()
+
 
   def __init__(self, lineno):
     Command.__init__(self, lineno)
@@ -347,6 +478,8 @@ class EndOfChorus(Command):
 class StartOfTablature(Command):
   """A start of tablature marker."""
 
+  __slots__ = ()
+
 
   def __init__(self, lineno):
     Command.__init__(self, lineno)
@@ -359,6 +492,8 @@ class StartOfTablature(Command):
 class EndOfTablature(Command):
   """A end of tablature marker."""
 
+  __slots__ = ()
+
 
   def __init__(self, lineno):
     Command.__init__(self, lineno)
@@ -371,6 +506,8 @@ class EndOfTablature(Command):
 class Comment(Command):
   """A chordpro {comment:...} entry."""
 
+  __slots__ = ('value',)
+
 
   def __init__(self, lineno, value):
     Command.__init__(self, lineno)
@@ -381,21 +518,32 @@ class Comment(Command):
     return '%03d {comment: %s}' % (self.lineno, self.value)
 
 
+  def html_parts(self, out):
+    out += (u'<span class="comment">', self.value, u'</span>\n')
+
+
   def as_html(self):
-    return u'<span class="comment">%s</span>\n' % self.value
+    return render_html([self])
 
 
   def as_pdf(self, width):
     return [u'<font color=#444444><i>' + k + '</i></font>' for k in break_line(self.value, width)]
 
 
+  def as_block(self, width):
+    return ('comment', '\n'.join(break_line(self.value, width)))
+
+
   def as_flowable(self, width):
-    return pdf.XPreformatted('\n'.join(break_line(self.value, width)), pdf.style['comment'])
+    style, text = self.as_block(width)
+    return pdf.Block(text, pdf.style[style])
 
 
 class UnsupportedCommand(Command):
   """One of the chordpro commands we don't support."""
 
+  __slots__ = ('command', 'value')
+
 
   def __init__(self, command, value, lineno):
     Command.__init__(self, lineno)
@@ -408,89 +556,193 @@ class UnsupportedCommand(Command):
         (self.lineno, self.command, self.value)
 
 
+  def html_parts(self, out):
+    pass
+
+
   def as_html(self):
     return u''
 
 
 class CommandParser:
-  """Parses and generates the proper command from the input."""
+  """Parses and generates the proper command from the input.
 
+  All known directives are combined in a single regular expression, so each
+  ``{...}`` line is matched only once. The name of the alternative that
+  matched indexes a dispatch table with the factory for the command object.
+  Use :py:meth:`CommandParser.register` to teach the parser new directives.
+  """
 
-  comment = re.compile(r'{\s*(comment|c)\s*:\s*(?P<v>.*)}', re.I)
-  soc = re.compile(r'{\s*(start_of_chorus|soc)\s*}', re.I)
-  eoc = re.compile(r'{\s*(end_of_chorus|eoc)\s*}', re.I)
-  sot = re.compile(r'{\s*(start_of_tab|sot)\s*}', re.I)
-  eot = re.compile(r'{\s*(end_of_tab|eot)\s*}', re.I)
-  define = re.compile(r'{\s*(define)\s+(?P<v>.*)}', re.I)
-  title = re.compile(r'{\s*(title|t)\s*:\s*(?P<v>.*)}', re.I)
-  subtitle = re.compile(r'{\s*(subtitle|st)\s*:\s*(?P<v>.*)}', re.I)
+
+  directives = [] #ordered list of (name, pattern, factory)
+  dispatch = {} #name -> (factory, has_value)
+  scanner = None #the combined regular expression
 
 
   def __init__(self):
     pass
 
 
+  @classmethod
+  def register(cls, name, pattern, factory):
+    """Registers a new directive with the parser
+
+    Parameters:
+
+      name (str): A unique name for the directive. It must be a valid python
+        identifier as it is used to name the matching group
+
+      pattern (str): The regular expression for the directive, excluding the
+        opening curly brace and spaces that may follow it. If the directive
+        has a value, it must be captured by the (only) group in the pattern
+
+      factory (callable): A callable that receives the directive value (or
+        ``None``, if the directive takes no values) and the line number, and
+        returns the command object
+
+
+    Raises:
+
+      ValueError: if a directive with the same name is already registered
+
+      re.error: if the name or the pattern are not valid. The parser is left
+        unchanged
+
+    """
+
+    if name in cls.dispatch:
+      raise ValueError('directive %r is already registered' % (name,))
+
+    # compiles everything first, so the parser is unchanged on errors
+    has_value = re.compile(pattern).groups > 0
+    directives = cls.directives + [(name, pattern, factory)]
+    dispatch = dict(cls.dispatch)
+    dispatch[name] = (factory, has_value)
+    scanner = re.compile(r'{\s*(?:%s)' % '|'.join(['(?P<%s>%s)' % k[:2] \
+        for k in directives]), re.I)
+
+    cls.directives = directives
+    cls.dispatch = dispatch
+    cls.scanner = scanner
+
+
   def __call__(self, v, lineno):
-    if CommandParser.comment.match(v): return Comment(lineno, CommandParser.comment.match(v).group('v'))
-    elif CommandParser.soc.match(v): return StartOfChorus(lineno)
-    elif CommandParser.eoc.match(v): return EndOfChorus(lineno)
-    elif CommandParser.sot.match(v): return StartOfTablature(lineno)
-    elif CommandParser.eot.match(v): return EndOfTablature(lineno)
-    elif CommandParser.define.match(v):
-      return UnsupportedCommand('define', CommandParser.define.match(v).group('v'), lineno)
-    elif CommandParser.title.match(v):
-      return UnsupportedCommand('title', CommandParser.title.match(v).group('v'), lineno)
-    elif CommandParser.subtitle.match(v):
-      return UnsupportedCommand('subtitle', CommandParser.subtitle.match(v).group('v'), lineno)
+    m = CommandParser.scanner.match(v)
 
     #we don't do anything if the command is unsupported
-    return HashComment('#' + v + ' [IGNORED]', lineno)
+    if m is None: return HashComment('#' + v + ' [IGNORED]', lineno)
+
+    factory, has_value = CommandParser.dispatch[m.lastgroup]
+    value = m.group(m.lastindex + 1) if has_value else None
+    return factory(value, lineno)
+
+
+CommandParser.register('comment', r'(?:comment|c)\s*:\s*(.*)}',
+    lambda v, lineno: Comment(lineno, v))
+CommandParser.register('soc', r'(?:start_of_chorus|soc)\s*}',
+    lambda v, lineno: StartOfChorus(lineno))
+CommandParser.register('eoc', r'(?:end_of_chorus|eoc)\s*}',
+    lambda v, lineno: EndOfChorus(lineno))
+CommandParser.register('sot', r'(?:start_of_tab|sot)\s*}',
+    lambda v, lineno: StartOfTablature(lineno))
+CommandParser.register('eot', r'(?:end_of_tab|eot)\s*}',
+    lambda v, lineno: EndOfTablature(lineno))
+CommandParser.register('define', r'define\s+(.*)}',
+    lambda v, lineno: UnsupportedCommand('define', v, lineno))
+CommandParser.register('title', r'(?:title|t)\s*:\s*(.*)}',
+    lambda v, lineno: UnsupportedCommand('title', v, lineno))
+CommandParser.register('subtitle', r'(?:subtitle|st)\s*:\s*(.*)}',
+    lambda v, lineno: UnsupportedCommand('subtitle', v, lineno))
 
 
 class LineParser:
 
-  chord = re.compile(r'\[(?P<v>[^\]]*)\]')
-
 
   def __init__(self):
     pass
 
 
   def __call__(self, l, lineno):
-    if LineParser.chord.search(l): return ChordLine(l, lineno)
+    scanned = scan_chords(l)
+    if scanned[1]: return ChordLine(l, lineno, scanned)
     return Line(l, lineno)
 
 
-def parse(t):
-  """Parses a chord-pro formatted file and turns the input into low-level
-  constructs that can be easily analyzed by our high-level syntax parser."""
+def iparse(lines):
+  """Lazily parses chord-pro formatted lines, yielding low-level constructs as
+  they are read. ``lines`` may be any iterable of strings, such as an open
+  file, so songs do not have to be loaded in memory in full."""
 
-  input = []
   cmdparser = CommandParser()
   lineparser = LineParser()
-  for i, l in enumerate(t.split('\n')):
+  for i, l in enumerate(lines):
     sl = l.strip()
-    if not sl: input.append(EmptyLine(i+1))
-    elif sl[0] == '#': input.append(HashComment(sl, i+1))
-    elif sl[0] == '{': input.append(cmdparser(sl, i+1))
-    else: input.append(lineparser(l.rstrip(), i+1))
+    if not sl: yield EmptyLine(i+1)
+    elif sl[0] == '#': yield HashComment(sl, i+1)
+    elif sl[0] == '{': yield cmdparser(sl, i+1)
+    else: yield lineparser(l.rstrip(), i+1)
+
+
+def parse(t):
+  """Parses a chord-pro formatted file and turns the input into low-level
+  constructs that can be easily analyzed by our high-level syntax parser.
+  ``t`` is either the whole song as a string or an iterable of lines."""
+
+  if isinstance(t, str): t = t.split('\n')
+  return list(iparse(t))
+
+
+class Lookahead:
+  """Wraps an iterator so its next element can be inspected before consuming
+  it. Implements the subset of :py:class:`collections.deque` used by the
+  ``consume_*`` functions below and counts consumed elements."""
+
+  __slots__ = ('_iterator', '_next', 'consumed')
+
+  _end = object() #marks the end of the input
+
+
+  def __init__(self, iterable):
+    self._iterator = iter(iterable)
+    self.consumed = 0
+    self._advance()
+
+
+  def _advance(self):
+    self._next = next(self._iterator, Lookahead._end)
+
+
+  def __bool__(self):
+    return self._next is not Lookahead._end
+
+
+  def __getitem__(self, i):
+    if i != 0 or self._next is Lookahead._end:
+      raise IndexError('Lookahead index out of range')
+    return self._next
 
-  return input
+
+  def popleft(self):
+    retval = self[0]
+    self._advance()
+    self.consumed += 1
+    return retval
 
 
 def consume_chorus(input):
   """This method will consume the whole of a chorus section until an end marker
-  is found."""
+  is found. ``input`` is a :py:class:`collections.deque` or a
+  :py:class:`Lookahead`."""
   if not input: return []
 
   if isinstance(input[0], StartOfChorus):
-    retval = Chorus(input.pop(0))
+    retval = Chorus(input.popleft())
   else:
     return []
 
   while True:
     try:
-      i = input.pop(0)
+      i = input.popleft()
       if isinstance(i, EndOfChorus):
         retval.end(i)
         return [retval]
@@ -507,17 +759,18 @@ def consume_chorus(input):
 
 def consume_tablature(input):
   """This method will consume the whole of a tablature section until an end
-  marker is found."""
+  marker is found. ``input`` is a :py:class:`collections.deque` or a
+  :py:class:`Lookahead`."""
   if not input: return []
 
   if isinstance(input[0], StartOfTablature):
-    retval = Tablature(input.pop(0))
+    retval = Tablature(input.popleft())
   else:
     return []
 
   while True:
     try:
-      i = input.pop(0)
+      i = input.popleft()
       if isinstance(i, EndOfTablature):
         retval.end(i)
         return [retval]
@@ -529,7 +782,7 @@ def consume_tablature(input):
       else:
         retval.append(i)
     except IndexError: #input has ended w/o closing
-      return retval
+      return [retval]
 
 
 def consume_extra(input):
@@ -538,7 +791,7 @@ def consume_extra(input):
 
   try:
     while isinstance(input[0], (EmptyLine, HashComment, Comment, UnsupportedCommand)):
-      retval.append(input.pop(0))
+      retval.append(input.popleft())
   except IndexError: #input has ended
     pass
 
@@ -550,13 +803,13 @@ def consume_verse(input):
   if not input: return []
   if isinstance(input[0], Line):
     retval = Verse()
-    retval.append(input.pop(0))
+    retval.append(input.popleft())
   else:
     return []
 
   try:
     while not isinstance(input[0], (EmptyLine, HashComment, Command)):
-      retval.append(input.pop(0))
+      retval.append(input.popleft())
   except IndexError: #input has ended
     pass
 
@@ -564,11 +817,45 @@ def consume_verse(input):
   return [retval]
 
 
+def isyntax_analysis(input):
+  """Lazily groups low-level constructs to make up Choruses, Tablatures and
+  Verses, yielding each of them as soon as it is closed.
+
+  The input may be any iterable of low-level constructs (e.g. the output of
+  :py:func:`iparse`). It is wrapped in a :py:class:`Lookahead`, so that every
+  construct is consumed from the front in constant time, making the whole
+  analysis linear on the number of lines. A list given as input is left
+  untouched.
+  """
+
+  input = Lookahead(input)
+
+  # Makes sure we don't have any syntactical problems
+  while input:
+    consumed = input.consumed
+    for k in consume_extra(input): yield k
+    for k in consume_verse(input): yield k
+    for k in consume_chorus(input): yield k
+    for k in consume_tablature(input): yield k
+    if consumed == input.consumed: #nothing was consumed
+      raise SyntaxError('Cannot make sense of "%s"' % (input[0]))
+
+
 def syntax_analysis(input):
   """Syntax analysis groups low-level constructs to make up Choruses,
-  Tablatures and Verses."""
+  Tablatures and Verses. Returns a list with all of them.
+
+  Lists and tuples (e.g. the output of :py:func:`parse`) are copied into a
+  :py:class:`collections.deque`, which is faster to consume than a
+  :py:class:`Lookahead`. The input itself is left untouched. Other iterables
+  are analyzed with :py:func:`isyntax_analysis`.
+  """
+
+  if not isinstance(input, (list, tuple)):
+    return list(isyntax_analysis(input))
 
   retval = []
+  input = collections.deque(input)
 
   # Makes sure we don't have any syntactical problems
   while input:
@@ -583,16 +870,76 @@ def syntax_analysis(input):
   return retval
 
 
-if __name__ == '__main__':
-  import os
-  import sys
+def _parse_chunk(texts, timed=False):
+  """Parses and analyzes a list of songs. Runs on worker processes."""
+
+  if not timed: return [syntax_analysis(parse(k)) for k in texts]
+
+  retval = []
+  for k in texts:
+    start = time.process_time()
+    items = syntax_analysis(parse(k))
+    retval.append((items, time.process_time() - start))
+  return retval
+
+
+def parse_many(texts, workers=None, chunksize=None, timed=False):
+  """Parses and analyzes many songs at once, using a pool of processes.
+
+  Songs are sent to the workers in chunks, to amortize communication costs.
+  Results are returned in the same order as the input, as lists of items like
+  the ones returned by :py:func:`syntax_analysis`.
 
+
+  Parameters:
+
+    texts (list): The chord-pro contents of each song, as strings
+
+    workers (int): The number of worker processes to use. If not set, use
+      as many as CPUs available. If smaller than 2, songs are parsed on the
+      calling process
+
+    chunksize (int): The number of songs on each chunk sent to a worker. If
+      not set, splits the songs in 4 chunks per worker
+
+    timed (bool): If set, also measures the (CPU) time spent on each song
+
+
+  Returns:
+
+    list: A list with the parsed items of each song. If ``timed`` is set,
+    a list of ``(items, seconds)`` tuples instead
+
+
+  Raises:
+
+    SyntaxError: if any of the songs cannot be analyzed
+
+  """
+
+  texts = list(texts)
+  if workers is None: workers = os.cpu_count() or 1
+  workers = min(workers, len(texts))
+  if workers < 2: return _parse_chunk(texts, timed)
+
+  if chunksize is None: chunksize = -(-len(texts) // (4 * workers))
+  chunks = [texts[k:k+chunksize] for k in range(0, len(texts), chunksize)]
+
+  retval = []
+  with concurrent.futures.ProcessPoolExecutor(workers) as executor:
+    for k in executor.map(_parse_chunk, chunks, [timed] * len(chunks)):
+      retval += k
+  return retval
+
+
+if __name__ == '__main__':
   if len(sys.argv) == 1:
     print('usage: %s <file.chord>' % os.path.basename(sys.argv[0]))
     sys.exit(1)
 
-  f = codecs.open(sys.argv[1], 'rt', 'utf-8')
-  items = syntax_analysis(parse(f))
-  f.close()
-  print('File %s contains %d blocks' % (sys.argv[1], len(items)))
-  for k in items: print(k)
+  blocks = 0
+  with open(sys.argv[1], 'rt', encoding='utf-8') as f:
+    for k in isyntax_analysis(iparse(f)):
+      print(k)
+      blocks += 1
+  print('File %s contains %d blocks' % (sys.argv[1], blocks))
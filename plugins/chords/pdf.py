@@ -5,13 +5,19 @@
 """
 
 import os
+import io
+import time
+import hashlib
 import datetime
-import PIL
 import contextlib
 
+import logging
+logger = logging.getLogger(__name__)
+
 # the pdf generation stuff
 from reportlab.platypus import Paragraph, XPreformatted, Spacer, CondPageBreak
-from reportlab.platypus.flowables import NullDraw
+from reportlab.platypus.flowables import NullDraw, Flowable
+from reportlab.platypus.doctemplate import ActionFlowable
 from reportlab.platypus import NextPageTemplate
 from reportlab.platypus import BaseDocTemplate
 from reportlab.lib.styles import ParagraphStyle
@@ -23,12 +29,6 @@ style = {}
 
 fontsize = 10 #points
 
-# This is an estimation of the number of characters that fits in a
-# single-column document with a fontsize as indicated above. We have no
-# heuristic to calculate how many there should be so, we have to create a
-# document and count.
-colwidth = {'single': 85, 'double': 41}
-
 style['normal'] = ParagraphStyle(name='normal',
                                  fontName='Times-Roman',
                                  fontSize=fontsize,
@@ -91,11 +91,196 @@ style['comment'] = ParagraphStyle(name='comment',
                                   fontName = 'Courier-Oblique')
 
 
-def tide(story, doc):
+# Songs already laid out on this process, as lists of PrerenderedPage
+# flowables, indexed by PdfSong.layout_key(). Cleared on every build, see
+# clear_caches().
+_layouts = {}
+
+
+def clear_caches():
+  """Forgets what was cached on this process by previous builds
+
+  Layouts, blocks and pictures are only re-used within a build. Long running
+  processes (e.g. ``pelican --autoreload``) would otherwise keep those of every
+  version of each song, and keep drawing artist pictures edited since they
+  were first loaded.
+  """
+
+  _layouts.clear()
+  _blocks.clear()
+  _images.clear()
+
+
+# CPU time spent laying out songs on this process, in seconds, indexed by song
+# slug. Collected (and cleared) by whoever runs the documents.
+layout_times = {}
+
+
+@contextlib.contextmanager
+def timed_layout(slug):
+  """Accounts the time spent under a ``with`` statement to a song layout"""
+
+  start = time.process_time()
+  yield
+  layout_times[slug] = layout_times.get(slug, 0.) + time.process_time() - start
+
+
+# Artist pictures loaded on this process, indexed by path. Cleared on every
+# build, see clear_caches().
+_images = {}
+
+
+class PerformerImage(object):
+  """A decoded artist picture, shared by all pages and documents
+
+
+  Parameters:
+
+    path (str): The path to the picture
+
+  """
+
+  def __init__(self, path):
+    from reportlab.lib.utils import ImageReader
+
+    self.reader = ImageReader(path)
+    self.width, self.height = self.reader.getSize()
+    self.name = 'performer-%s' % hashlib.sha1(path.encode('utf-8')).hexdigest()
+
+
+def performer_image(path):
+  """Returns the (cached) :py:class:`PerformerImage` for a picture"""
+
+  if path not in _images: _images[path] = PerformerImage(path)
+  return _images[path]
+
+
+# The styles of preformatted blocks, which are broken into lines of text
+# before being laid out (see text_width())
+block_styles = ('verse', 'chorus', 'tablature', 'comment')
+
+# Number of characters per line, indexed by (font name, font size, width)
+_text_widths = {}
+
+
+def text_width(frame_width, styles=block_styles):
+  """Returns how many characters fit on a line of a frame
+
+  The width of a character is taken from the metrics of the (fixed-pitch)
+  font of each style. The narrowest result is returned, so lines fit in the
+  frame whatever the style of the block they are in.
+
+
+  Parameters:
+
+    frame_width (float): The width available in the frame, in points
+
+    styles (sequence): Names of the styles (in :py:data:`style`) to consider
+
+  """
+
+  from reportlab.pdfbase.pdfmetrics import stringWidth
+
+  retval = []
+  for k in styles:
+    key = (style[k].fontName, style[k].fontSize, frame_width)
+    if key not in _text_widths:
+      char = stringWidth(u'M', style[k].fontName, style[k].fontSize)
+      _text_widths[key] = int(frame_width / char + 1e-6)
+    retval.append(_text_widths[key])
+  return min(retval)
+
+
+# The PDF blocks of songs, as tuples (style name, text, fragments) with their
+# text already broken into lines, marked up and parsed, indexed by (song
+# digest, characters per line). Cleared on every build, see clear_caches().
+_blocks = {}
+
+
+def song_blocks(song, width):
+  """Returns the (cached) PDF blocks of a song, for a number of characters per
+  line
+
+  The text layout of a song is done once per build, however many documents
+  contain it. This includes parsing the markup of each block into ReportLab
+  fragments, which takes most of the time.
+  """
+
+  key = (song.digest, width)
+  if key not in _blocks:
+    blocks = [k for k in (i.as_block(width) for i in song.items()) if k]
+    _blocks[key] = [(name, text, Block(text, style[name]).frags) \
+        for name, text in blocks]
+  return _blocks[key]
+
+
+def artist_color(value):
+  """Returns the equivalent reportlab Color object from an artist color
+
+  Artist colors are set as ``0xRRGGBB`` integers on their YAML files.
+  ``ValueError`` is raised if the value is not a valid color.
+  """
+
+  if isinstance(value, bool) or not isinstance(value, int) or \
+      not 0 <= value <= 0xffffff:
+    raise ValueError('invalid artist color %r, it should be an integer ' \
+        'between 0x000000 and 0xffffff' % (value,))
+
+  rgb = ((value >> 16) & 0xff, (value >> 8) & 0xff, value & 0xff)
+  return Color(*([k/255.0 for k in rgb] + [1.0]))
+
+
+class Block(XPreformatted):
+  """A block of preformatted lines, such as a verse, chorus or tablature
+
+  Preformatted lines are never wrapped, so the height of the block is known
+  from its number of lines and the leading of its style, without calling
+  ``wrap()``. It is computed once, when the block is created.
+
+
+  Parameters:
+
+    text (str): The lines of the block, separated by new lines
+
+    style (ParagraphStyle): The style to use for the block
+
+    bulletText (str): Passed to XPreformatted
+
+    frags (list): If set, the already parsed fragments of ``text``, which are
+      then not parsed again
+
+  Blocks taller than a frame are split by ReportLab into new blocks, made
+  from fragments only: ``cls(None, style, bulletText=..., frags=...)``. Those
+  have no ``fixed_height``. Arguments after ``style`` are keyword-only, so
+  they cannot be mistaken for one another.
+
+  """
+
+  def __init__(self, text, style, *, bulletText=None, frags=None, **kwargs):
+    XPreformatted.__init__(self, text, style, bulletText=bulletText,
+        frags=frags, **kwargs)
+
+    if text is None: #a piece of a split block
+      self.fixed_height = None
+      return
+
+    # XPreformatted drops empty lines at the start and at the end
+    lines = text.split('\n')
+    start = 0
+    while start < len(lines) and not lines[start].strip(): start += 1
+    end = len(lines)
+    while end > start and not lines[end-1].strip(): end -= 1
+    self.fixed_height = (end - start) * style.leading
+
+
+def tide(story, doc, verify=False):
   """This method will pre-calculate the size of the following flowable and
   force a page break on the story if the space available is not enough to
   contain the flowable. This avoids the break-up verses, choruses and
-  tablatures."""
+  tablatures.
+
+  The height of :py:class:`Block` flowables is not calculated with ``wrap()``,
+  unless ``verify`` is set, in which case both are checked to agree."""
 
   retval = []
   frame_width = doc.width - doc.leftMargin - doc.rightMargin
@@ -105,7 +290,15 @@ def tide(story, doc):
       retval.append(k)
       continue
 
-    width, height = k.wrap(frame_width, frame_height)
+    if isinstance(k, Block):
+      height = k.fixed_height
+      if verify:
+        wrapped = k.wrap(frame_width, frame_height)[1]
+        if abs(wrapped - height) > 1e-6:
+          raise AssertionError('block height is %g, but wrap() returns %g ' \
+              'for %r' % (height, wrapped, k.text[:80]))
+    else:
+      width, height = k.wrap(frame_width, frame_height)
     retval.append(CondPageBreak(height))
     retval.append(k)
 
@@ -256,7 +449,43 @@ def set_basic_templates(doc):
   doc.addPageTemplates(templates)
 
 
+class PrerenderedPage(Flowable):
+  """A page of a song that was already laid out
+
+  Drawing it replays the recorded flowables at the same positions they had on
+  the page they were laid out on, without wrapping or splitting anything
+  again. It takes no space on the frame it is added to, so it must be
+  followed by a page break.
+
+
+  Parameters:
+
+    items (list): A list of tuples ``(flowable, x, y, sW)`` with the flowables
+      drawn on the page and the arguments they were drawn with (see
+      :py:meth:`SongTemplate.afterFlowable`)
+
+  """
+
+  def __init__(self, items):
+    Flowable.__init__(self)
+    self.items = items
+
+
+  def wrap(self, availWidth, availHeight):
+    return (0, 0)
+
+
+  def drawOn(self, canvas, x, y, _sW=0):
+    for flowable, fx, fy, sW in self.items:
+      flowable.drawOn(canvas, fx, fy, _sW=sW)
+
+
 class SongTemplate(BaseDocTemplate):
+  """A document template for songs
+
+  If ``pages`` is set to a list, the flowables drawn on each page are recorded
+  on it, so the layout can be replayed with :py:class:`PrerenderedPage`.
+  """
 
   def __init__(self, *args, **kwargs):
     from reportlab.lib.units import cm
@@ -266,6 +495,22 @@ class SongTemplate(BaseDocTemplate):
     kwargs.setdefault('bottomMargin', 1.5 * cm)
 
     BaseDocTemplate.__init__(self, *args, **kwargs)
+    self.pages = None
+
+
+  def afterFlowable(self, flowable):
+    """Records where flowables were drawn, if requested"""
+
+    if self.pages is None: return
+    if isinstance(flowable, (ActionFlowable, Spacer)): return #nothing drawn
+
+    while len(self.pages) < self.page: self.pages.append([])
+    frame = self.frame
+    x = frame._x + frame._leftExtraIndent
+    y = frame._y + flowable.getSpaceAfter()
+    aW = frame._getAvailableWidth()
+    sW = aW - getattr(flowable, 'width', aW)
+    self.pages[self.page-1].append((flowable, x, y, sW))
 
 
 class SongBookTemplate(BaseDocTemplate):
@@ -280,16 +525,96 @@ class SongBookTemplate(BaseDocTemplate):
 
     BaseDocTemplate.__init__(self, *args, **kwargs)
     set_basic_templates(self)
+    self.entries = []
 
 
   def afterFlowable(self, flowable):
     """Registers TOC entries in our Doc Templates."""
 
-    if flowable.__class__.__name__ == 'Paragraph' and \
-        flowable.style.name == 'song-title':
+    for k in song_titles(flowable):
       key = 'song-title-%s' % self.seq.nextf('song-title')
       self.canv.bookmarkPage(key)
-      self.notify('TOCEntry', (0, flowable.getPlainText(), self.page, key))
+      entry = (0, k.getPlainText(), self.page, key)
+      self.entries.append(entry)
+      self.notify('TOCEntry', entry)
+
+
+def song_titles(flowable):
+  """Returns the song titles in a flowable, or in a pre-rendered page"""
+
+  if isinstance(flowable, PrerenderedPage):
+    flowables = [k[0] for k in flowable.items]
+  else:
+    flowables = [flowable]
+
+  return [k for k in flowables if k.__class__.__name__ == 'Paragraph' and \
+      k.style.name == 'song-title']
+
+
+def table_of_contents(entries=None):
+  """Returns the table of contents for chordbooks
+
+  If ``entries`` are given, they are drawn on the next build, without having
+  to run a multi-pass build.
+  """
+
+  from reportlab.platypus.tableofcontents import TableOfContents
+
+  retval = TableOfContents()
+  retval.levelStyles[0] = style['toc-entry']
+  retval.dotsMinLevel = 0 #connecting dots
+  if entries is not None:
+    retval.addEntries(entries)
+    retval.beforeBuild() #makes the entries the ones to draw
+  return retval
+
+
+def plan_toc(cover, pages):
+  """Computes the TOC entries of a chordbook made of pre-rendered pages
+
+  Each song starts on a new page, right after the cover and the TOC, so the
+  page of each title is known once the number of TOC pages is. The cover and
+  TOC are laid out on a scratch document to find it out, which is repeated
+  if the TOC length changes with the page numbers it shows.
+
+
+  Parameters:
+
+    cover (list): The flowables of the cover page
+
+    pages (list): For each song in the chordbook, the list of its
+      :py:class:`PrerenderedPage` flowables
+
+
+  Returns:
+
+    list: The TOC entries, or ``None`` if they could not be planned
+
+  """
+
+  from reportlab.lib.sequencer import Sequencer
+  from reportlab.platypus import PageBreak
+
+  first = 3 #first song page: after the cover and a single page of TOC
+  for attempt in range(3):
+    entries = []
+    seq = Sequencer() #the same numbering of SongBookTemplate.afterFlowable
+    page = first
+    for song in pages:
+      for k in song:
+        for title in song_titles(k):
+          entries.append((0, title.getPlainText(), page,
+            'song-title-%s' % seq.nextf('song-title')))
+        page += 1
+
+    #links are dropped, as titles are not on the scratch document
+    scratch = SongBookTemplate(io.BytesIO())
+    scratch.build(cover + [NextPageTemplate('TOC'), PageBreak(),
+      table_of_contents([k[:3] + (None,) for k in entries])])
+    if scratch.page + 1 == first: return entries
+    first = scratch.page + 1
+
+  return None
 
 
 def cover_page(title, subtitle, url, siteurl, dateformat):
@@ -320,12 +645,16 @@ class PdfSong(object):
 
     dateformat (str): The format of the date to use for PDF generation
 
+    verify (bool): If set, block heights are checked against ``wrap()`` (see
+      :py:func:`tide`)
+
   """
 
 
-  def __init__(self, song, dateformat):
+  def __init__(self, song, dateformat, verify=False):
     self.song = song
     self.dateformat = dateformat
+    self.verify = verify
 
 
   def basic_page(self, canvas, doc):
@@ -337,14 +666,14 @@ class PdfSong(object):
     # draws the rectangle with the performer name and picture
     # remember: coordinates (0,0) start at bottom left and go up and to the
     # right!
-    canvas.setFillColor(self.performer_color())
+    canvas.setFillColor(self.song.performer.pdf_color)
     page_height = doc.bottomMargin + doc.height + doc.topMargin
     page_width = doc.leftMargin + doc.width + doc.rightMargin
     y = page_height - doc.topMargin + 0.2*cm # a bit above the top margin
     rect_height = page_height - y
     canvas.rect(0, y, page_width, rect_height, fill=True, stroke=False)
 
-    image = PIL.Image.open(self.song.performer.image_path)
+    image = performer_image(self.song.performer.thumbnail_path)
 
     image_height = 100
     image_width = (image_height/float(image.height)) * image.width
@@ -356,8 +685,17 @@ class PdfSong(object):
     canvas.setStrokeGray(0.8)
     canvas.roundRect(image_x-border, image_y-border, image_width + (2*border),
         image_height + (2*border), radius=border/2, fill=True, stroke=True)
-    canvas.drawImage(self.song.performer.image_path, image_x, image_y,
-        width=image_width, height=image_height, mask=None)
+
+    # the picture is drawn once per document, as a form other pages re-use
+    if not canvas.hasForm(image.name):
+      canvas.beginForm(image.name, 0, 0, image_width, image_height)
+      canvas.drawImage(image.reader, 0, 0, width=image_width,
+          height=image_height, mask=None)
+      canvas.endForm()
+    canvas.saveState()
+    canvas.translate(image_x, image_y)
+    canvas.doForm(image.name)
+    canvas.restoreState()
 
     name = canvas.beginText()
     name.setTextOrigin(doc.leftMargin, y+0.4*cm)
@@ -376,7 +714,7 @@ class PdfSong(object):
     # draws a line between the columns if we are in two column mode
     if self.song.two_columns:
       start_pad = 1.5*cm
-      canvas.setStrokeColor(self.performer_color())
+      canvas.setStrokeColor(self.song.performer.pdf_color)
       canvas.setLineWidth(0.1*cm)
       canvas.setStrokeAlpha(0.5)
       canvas.setLineCap(1) #round ends
@@ -388,12 +726,11 @@ class PdfSong(object):
     return 'SongTemplate-%s' % self.song.slug
 
 
-  def add_page_template(self, doc):
-    """Adds song page template to the document."""
+  def frames(self, doc):
+    """Returns the frames of song pages in the document."""
 
     from reportlab.lib.units import cm
     from reportlab.platypus.frames import Frame
-    from reportlab.platypus.doctemplate import PageTemplate
 
     doc._calc() #taken from reportlab source code (magic)
 
@@ -419,6 +756,15 @@ class PdfSong(object):
       frames = Frame(doc.leftMargin, doc.bottomMargin, doc.width, doc.height,
           id='normal', leftPadding=0, rightPadding=0)
 
+    return frames
+
+
+  def add_page_template(self, doc):
+    """Adds song page template to the document."""
+
+    from reportlab.platypus.doctemplate import PageTemplate
+
+    frames = self.frames(doc)
     template = [PageTemplate(id='FirstPageSongTemplate', frames=frames,
       onPage=self.page_template_first, pagesize=doc.pagesize)]
     doc.addPageTemplates(template)
@@ -435,17 +781,6 @@ class PdfSong(object):
     canvas.restoreState()
 
 
-  def performer_color(self):
-   """Returns the equivalent reportlab Color object from the artist color."""
-
-   import struct
-   from reportlab.lib.colors import Color
-
-   rgb = struct.unpack('4B', struct.pack('>I', self.song.performer.color))[1:]
-   pdf = [k/255.0 for k in rgb] + [1.0]
-   return Color(*pdf)
-
-
   def page_template(self, canvas, doc):
     """Creates a personalized PDF page view for this song."""
 
@@ -472,7 +807,7 @@ class PdfSong(object):
     page.textLine('%d' % page_number)
 
     #circle around number
-    canvas.setFillColor(self.performer_color())
+    canvas.setFillColor(self.song.performer.pdf_color)
     circle_x, circle_y = page_circle_center(page_x, page_y,
         page_fontsize, page_number)
     canvas.circle(circle_x, circle_y, 1.5*page_fontsize, fill=True,
@@ -484,20 +819,75 @@ class PdfSong(object):
     canvas.restoreState()
 
 
+  def text_width(self, doc):
+    """Returns how many characters fit on a line of this song's columns"""
+
+    frames = self.frames(doc)
+    if isinstance(frames, list): frames = frames[0] #all columns are the same
+    return text_width(frames._getAvailableWidth())
+
+
   def story(self, doc):
     """Writes itself as a PDF story."""
 
-    # what is the maximum width of text?
-    if self.song.two_columns: width = colwidth['double']
-    else: width = colwidth['single']
+    width = self.text_width(doc)
 
     story = [Paragraph(self.song.title, style['song-title'])]
     story.append(Paragraph('Tom: %s' % self.song.tone, style['tone']))
     story.append(Spacer(1, fontsize))
-    story += [k.as_flowable(width) for k in self.song.items()]
+    story += [Block(text, style[name], frags=frags) for name, text, frags in \
+        song_blocks(self.song, width)]
     story = [k for k in story if k]
 
-    return tide(story, doc)
+    return tide(story, doc, self.verify)
+
+
+  def layout_key(self, doc):
+    """Identifies the layout of this song in a document
+
+    Song and chordbook templates share page sizes, margins and frames, so
+    layouts recorded in either of them can be replayed in both.
+    """
+
+    return (self.song.slug, self.song.digest, self.song.title, self.song.tone,
+        self.song.two_columns, tuple(doc.pagesize), doc.leftMargin,
+        doc.rightMargin, doc.topMargin, doc.bottomMargin)
+
+
+  def pages(self, doc):
+    """Returns the song laid out as :py:class:`PrerenderedPage` flowables
+
+    Layouts are recorded once per process (see :py:data:`_layouts`). If the
+    song was not laid out yet, it is built into a scratch document with no
+    page decorations.
+    """
+
+    from reportlab.platypus.doctemplate import PageTemplate
+
+    key = self.layout_key(doc)
+    if key not in _layouts:
+      with timed_layout(self.song.slug):
+        scratch = SongTemplate(io.BytesIO())
+        story = self.story(scratch)
+        scratch.addPageTemplates([PageTemplate(id='Layout',
+          frames=self.frames(scratch), pagesize=scratch.pagesize)])
+        scratch.pages = []
+        scratch.build(story)
+        _layouts[key] = [PrerenderedPage(k) for k in scratch.pages]
+
+    return _layouts[key]
+
+
+def prerendered_story(pages):
+  """Returns a story with pre-rendered pages, separated by page breaks"""
+
+  from reportlab.platypus import PageBreak
+
+  story = []
+  for k in pages:
+    if story: story.append(PageBreak())
+    story.append(k)
+  return story
 
 
 @contextlib.contextmanager
@@ -559,7 +949,6 @@ def chordbook(filename, objects, title, subtitle, url, settings):
 
   """
 
-  from reportlab.platypus.tableofcontents import TableOfContents
   from reportlab.platypus import NextPageTemplate, PageBreak
 
   with pelican_locale(settings):
@@ -570,22 +959,37 @@ def chordbook(filename, objects, title, subtitle, url, settings):
     doc.subject = 'Compilação de Letras e Cifras'
     dateformat = settings.get('DEFAULT_DATE_FORMAT', '%d/%m/%Y')
 
-    story = cover_page(title, subtitle, url, siteurl, dateformat)
-
-    #appends and prepares table of contents
-    story.append(NextPageTemplate('TOC'))
-    story.append(PageBreak())
-    story.append(TableOfContents())
-    story[-1].levelStyles[0] = style['toc-entry']
-    story[-1].dotsMinLevel = 0 #connecting dots
+    cover = cover_page(title, subtitle, url, siteurl, dateformat)
 
     #adds the lyrics
+    prerender = settings.get('CHORDS_PDF_PRERENDER', True)
+    verify = settings.get('CHORDS_PDF_VERIFY_HEIGHTS', False)
+    pages = []
+    songs = []
     for o in objects:
-      po = PdfSong(o, dateformat)
+      po = PdfSong(o, dateformat, verify)
       po.add_page_template(doc)
-      story.append(NextPageTemplate(po.template_id()))
-      story.append(PageBreak())
-      story += po.story(doc)
+      songs.append(NextPageTemplate(po.template_id()))
+      songs.append(PageBreak())
+      if prerender:
+        pages.append(po.pages(doc))
+        songs += prerendered_story(pages[-1])
+      else:
+        with timed_layout(o.slug): songs += po.story(doc)
+
+    #if the page of each song is known, the TOC is drawn on a single pass
+    entries = plan_toc(cover, pages) if prerender else None
+
+    #appends and prepares table of contents
+    toc = table_of_contents(entries)
+    story = cover + [NextPageTemplate('TOC'), PageBreak(), toc] + songs
+
+    if entries is not None:
+      doc.build(story[:])
+      if doc.entries == entries: return doc
+      logger.debug('Chordbook %s does not paginate as planned, rebuilding ' \
+          'with multiple passes', filename)
+      toc.addEntries(doc.entries)
 
     #multi-pass builds are necessary to handle TOCs correctly
     doc.multiBuild(story)
@@ -621,10 +1025,23 @@ def song(filename, song, settings):
     doc.subject = 'Letra e Cifra'
     dateformat = settings.get('DEFAULT_DATE_FORMAT', '%d/%m/%Y')
 
-    so = PdfSong(song, dateformat)
+    so = PdfSong(song, dateformat,
+        settings.get('CHORDS_PDF_VERIFY_HEIGHTS', False))
 
-    story = so.story(doc)
+    # re-uses the layout of the song if a chordbook already did it, or records
+    # it for the chordbooks built next on this process
+    key = so.layout_key(doc)
+    prerender = settings.get('CHORDS_PDF_PRERENDER', True)
     so.add_page_template(doc)
-    doc.build(story)
+    if prerender and key in _layouts:
+      doc.build(prerendered_story(_layouts[key]))
+    else:
+      with timed_layout(song.slug):
+        story = so.story(doc)
+        if prerender: doc.pages = []
+        doc.build(story)
+
+    if doc.pages is not None:
+      _layouts[key] = [PrerenderedPage(k) for k in doc.pages]
 
     return doc
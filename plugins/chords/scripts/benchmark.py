@@ -0,0 +1,418 @@
+#!/usr/bin/env python
+# vim: set fileencoding=utf-8 :
+
+"""Micro-benchmarks for the chords plugin.
+
+Run from the ``plugins`` directory, so the package imports resolve::
+
+  $ python -m chords.scripts.benchmark --help
+"""
+
+import os
+import re
+import sys
+import time
+import glob
+import argparse
+
+
+_CORPUS = os.path.realpath(os.path.join(os.path.dirname(__file__), '..', '..',
+  '..', 'content', 'chords', 'songs'))
+
+
+# A block of chordpro text containing verses, a chorus, a tablature and
+# comments. Synthetic songs are made by repeating it.
+_SAMPLE = u'''\
+{comment: Intro}
+[C]Twinkle, twinkle, [F]little [C]star,
+[F]How I [C]wonder [G7]what you [C]are!
+# a hash comment
+[C]Up a[F]bove the [C]world so [G7]high,
+Like a diamond in the sky.
+
+{start_of_chorus}
+[C]Little, [F]little, [C]little [G7]star,
+{c: 2x}
+[F]Little, [C]little, [G7]little [C]star.
+{end_of_chorus}
+
+{start_of_tab}
+|--------------0--0-------------------------------
+|--0--0--------------------------------2--2--0----
+{end_of_tab}
+'''
+
+
+def synthetic_song(lines):
+  """Returns a synthetic chordpro song with approximately ``lines`` lines"""
+
+  block = _SAMPLE.split(u'\n')
+  repeat = (lines // len(block)) + 1
+  return u'\n'.join((block * repeat)[:lines])
+
+
+def corpus(path):
+  """Returns the chordpro text of all songs in the given directory"""
+
+  import yaml
+
+  retval = []
+  for k in sorted(glob.glob(os.path.join(path, '*.yml'))):
+    with open(k, 'rt', encoding='utf-8') as f:
+      retval.append(yaml.safe_load(f)['song'])
+  return retval
+
+
+def _song(index, lines, performer):
+  """Returns a synthetic song, as used by the PDF generation"""
+
+  from ..test.fakes import Song
+
+  return Song(synthetic_song(lines), u'synthetic-song-%d' % index,
+      u'Synthetic Song %d' % index, bool(index % 2), performer)
+
+
+def timeit(function, *args):
+  """Returns the best wall-clock time of a few runs of ``function(*args)``"""
+
+  best = float('inf')
+  for k in range(3):
+    start = time.perf_counter()
+    function(*args)
+    best = min(best, time.perf_counter() - start)
+  return best
+
+
+def bench_syntax(args):
+  """Times :py:func:`parser.syntax_analysis` for songs of different sizes"""
+
+  from .. import parser
+
+  print('%10s %12s %14s' % ('lines', 'seconds', 'us/line'))
+  for size in args.sizes or [100, 1000, 10000, 100000]:
+    tokens = parser.parse(synthetic_song(size))
+    elapsed = timeit(parser.syntax_analysis, tokens)
+    print('%10d %12.4f %14.3f' % (size, elapsed, 1e6 * elapsed / size))
+
+
+def _sequential_commands():
+  """The directive matcher before the single-pass scanner, for reference"""
+
+  from .. import parser
+
+  comment = re.compile(r'{\s*(comment|c)\s*:\s*(?P<v>.*)}', re.I)
+  soc = re.compile(r'{\s*(start_of_chorus|soc)\s*}', re.I)
+  eoc = re.compile(r'{\s*(end_of_chorus|eoc)\s*}', re.I)
+  sot = re.compile(r'{\s*(start_of_tab|sot)\s*}', re.I)
+  eot = re.compile(r'{\s*(end_of_tab|eot)\s*}', re.I)
+  define = re.compile(r'{\s*(define)\s+(?P<v>.*)}', re.I)
+  title = re.compile(r'{\s*(title|t)\s*:\s*(?P<v>.*)}', re.I)
+  subtitle = re.compile(r'{\s*(subtitle|st)\s*:\s*(?P<v>.*)}', re.I)
+
+  def matcher(v, lineno):
+    if comment.match(v): return parser.Comment(lineno, comment.match(v).group('v'))
+    elif soc.match(v): return parser.StartOfChorus(lineno)
+    elif eoc.match(v): return parser.EndOfChorus(lineno)
+    elif sot.match(v): return parser.StartOfTablature(lineno)
+    elif eot.match(v): return parser.EndOfTablature(lineno)
+    elif define.match(v):
+      return parser.UnsupportedCommand('define', define.match(v).group('v'), lineno)
+    elif title.match(v):
+      return parser.UnsupportedCommand('title', title.match(v).group('v'), lineno)
+    elif subtitle.match(v):
+      return parser.UnsupportedCommand('subtitle', subtitle.match(v).group('v'), lineno)
+    return parser.HashComment('#' + v + ' [IGNORED]', lineno)
+
+  return matcher
+
+
+def bench_commands(args):
+  """Times the directive matching on all ``{...}`` lines of the corpus"""
+
+  from .. import parser
+
+  lines = []
+  for song in corpus(args.corpus):
+    lines += [k.strip() for k in song.split('\n') if k.strip()[:1] == '{']
+
+  def run(matcher):
+    for i, k in enumerate(lines): matcher(k, i)
+
+  reference = timeit(run, _sequential_commands())
+  current = timeit(run, parser.CommandParser())
+  print('%d directive lines from %s' % (len(lines), args.corpus))
+  print('%-12s %12s %14s' % ('matcher', 'seconds', 'us/line'))
+  for name, elapsed in (('sequential', reference), ('single-pass', current)):
+    print('%-12s %12.4f %14.3f' % (name, elapsed, 1e6 * elapsed / len(lines)))
+
+
+def bench_memory(args):
+  """Measures the memory held by parsed songs of the corpus with tracemalloc"""
+
+  import tracemalloc
+  from .. import parser
+
+  songs = corpus(args.corpus)
+
+  tracemalloc.start()
+  sizes = []
+  keep = []
+  for song in songs:
+    before = tracemalloc.get_traced_memory()[0]
+    keep.append(parser.syntax_analysis(parser.parse(song)))
+    sizes.append(tracemalloc.get_traced_memory()[0] - before)
+  tracemalloc.stop()
+
+  sizes.sort()
+  print('%d songs from %s' % (len(sizes), args.corpus))
+  print('%-8s %12s' % ('', 'bytes'))
+  print('%-8s %12d' % ('total', sum(sizes)))
+  print('%-8s %12.0f' % ('mean', float(sum(sizes)) / len(sizes)))
+  print('%-8s %12d' % ('median', sizes[len(sizes)//2]))
+  print('%-8s %12d' % ('max', sizes[-1]))
+
+
+def bench_wrap(args):
+  """Times :py:func:`parser.break_chordline` on very long chorded lines"""
+
+  import io
+  from .. import parser
+  from ..test.fakes import Performer
+
+  words = _SAMPLE.split(u'\n')[1].split(u' ')
+  doc = parser.pdf.SongTemplate(io.BytesIO())
+  performer = Performer(u'Synthetic Artist')
+  widths = [parser.pdf.PdfSong(_song(k, 1, performer), '').text_width(doc) \
+      for k in (0, 1)] #single and double columns
+
+  print('%10s %6s %12s %12s' % ('chars', 'width', 'incremental', 'quadratic'))
+  for size in args.sizes or [250, 500, 1000, 2000]:
+    line = u' '.join((words * size)[:size])[:size]
+    for width in widths:
+      current = timeit(parser.break_chordline, line, width)
+      reference = timeit(parser._break_chordline_slow, line.split(u' '), width)
+      print('%10d %6d %12.5f %12.5f' % (size, width, current, reference))
+
+
+def _regex_chordline(v):
+  """Splits lyrics and chords with regular expressions, as done before the
+  single-pass scanner, for reference"""
+
+  chord = re.compile(r'\[(?P<v>[^\]]*)\]')
+
+  if not chord.search(v): return v, ()
+  bare = chord.sub('', v)
+  subtract = 0
+  chords = []
+  for z in chord.finditer(v):
+    chords.append((z.start()-subtract, sys.intern(z.groups()[0])))
+    subtract = z.end() + (z.end() - z.start()) - 2
+  for i, c in enumerate(chords[1:]):
+    if c[0] <= 0: chords[i+1] = (1, c[1])
+  return bare, tuple(chords)
+
+
+def bench_chordlines(args):
+  """Times the separation of lyrics and chords on all lines of the corpus"""
+
+  from .. import parser
+
+  lines = []
+  for song in corpus(args.corpus):
+    lines += [k.rstrip() for k in song.split('\n') \
+        if k.strip() and k.strip()[0] not in '#{']
+
+  def run(scanner):
+    for k in lines: scanner(k)
+
+  reference = timeit(run, _regex_chordline)
+  current = timeit(run, parser.scan_chords)
+  print('%d lyrics lines from %s' % (len(lines), args.corpus))
+  print('%-12s %12s %14s' % ('scanner', 'seconds', 'us/line'))
+  for name, elapsed in (('regex', reference), ('single-pass', current)):
+    print('%-12s %12.4f %14.3f' % (name, elapsed, 1e6 * elapsed / len(lines)))
+
+
+def bench_workers(args):
+  """Times :py:func:`parser.parse_many` with different numbers of workers"""
+
+  from .. import parser
+
+  print('%10s %8s %12s %10s' % ('songs', 'workers', 'seconds', 'speed-up'))
+  for size in args.sizes or [2000]:
+    texts = [synthetic_song(50 + (k % 100)) for k in range(size)]
+    serial = None
+    for workers in (1, 2, 4, 8):
+      elapsed = timeit(parser.parse_many, texts, workers)
+      if serial is None: serial = elapsed
+      print('%10d %8d %12.4f %10.2f' % (size, workers, elapsed,
+        serial / elapsed))
+
+
+def bench_chordbook(args):
+  """Times :py:func:`pdf.chordbook` for a single artist with many pages"""
+
+  import io
+  from .. import pdf
+  from ..test.fakes import Performer
+
+  performer = Performer(u'Synthetic Artist')
+  print('%10s %8s %12s %14s' % ('songs', 'pages', 'seconds', 'ms/page'))
+  for size in args.sizes or [250]:
+    songs = [_song(k, 120, performer) for k in range(size)]
+    build = lambda: pdf.chordbook(io.BytesIO(), songs, 'Artista',
+        performer.name, 'http://example.com', {})
+    pages = build().page
+    elapsed = timeit(build)
+    print('%10d %8d %12.4f %14.3f' % (size, pages, elapsed,
+      1e3 * elapsed / pages))
+
+
+def _commit():
+  """Returns the git commit of the plugin sources, if it can be found"""
+
+  import subprocess
+
+  try:
+    return subprocess.check_output(['git', 'rev-parse', 'HEAD'],
+        cwd=os.path.dirname(os.path.realpath(__file__)),
+        stderr=subprocess.DEVNULL).decode().strip()
+  except Exception:
+    return None
+
+
+def _clear_pdf_caches():
+  """Forgets the layouts and text cached by :py:mod:`pdf` on this process"""
+
+  from .. import pdf
+
+  pdf._layouts.clear()
+  pdf._blocks.clear()
+
+
+def bench_suite(args):
+  """Times all build stages on synthetic corpora of different sizes
+
+  For each size (number of songs), a synthetic site is generated with one
+  artist per 5 songs and one collection per 100 songs (see
+  :py:mod:`.synthetic`). Caches of the PDF module are cleared before each
+  run, so documents are laid out from scratch. Results are optionally saved
+  as JSON, to compare them across commits.
+  """
+
+  import io
+  import json
+  import datetime
+  import tempfile
+  import pelican.settings
+  from .. import parser, pdf
+  from ..generator import Generator
+  from . import synthetic
+
+  results = []
+
+  print('%8s %12s %12s %14s' % ('songs', 'stage', 'seconds', 'ms/song'))
+  for size in args.sizes or [50, 200, 500]:
+    artists = max(1, size // 5)
+    collections = max(1, size // 100)
+
+    with tempfile.TemporaryDirectory() as path:
+      synthetic.generate(os.path.join(path, 'content'), artists, size,
+          collections)
+      settings = pelican.settings.read_settings(override=dict(
+        PATH=os.path.join(path, 'content'),
+        OUTPUT_PATH=os.path.join(path, 'output'),
+        CACHE_PATH=os.path.join(path, 'cache'),
+        CHORDS_ARTISTS_PATHS=['artists'],
+        CHORDS_SONGS_PATHS=['songs'],
+        CHORDS_COLLECTIONS_PATHS=['collections'],
+        CHORDS_PARSE_CACHE=False,
+        ))
+
+      def load():
+        # the context is set up as Pelican does it (older and newer releases)
+        context = dict(settings, filenames={}, generated_content={},
+            static_content={}, static_links=set(),
+            localsiteurl=settings['SITEURL'])
+        generator = Generator(context, settings, settings['PATH'],
+            settings['THEME'], settings['OUTPUT_PATH'])
+        generator.generate_context()
+        return generator
+
+      songs = load().songs
+      texts = [k.song for k in songs]
+      tokens = [parser.parse(k) for k in texts]
+      doc = pdf.SongTemplate(io.BytesIO())
+
+      def story():
+        _clear_pdf_caches()
+        for k in songs: pdf.PdfSong(k, '%d/%m/%Y').story(doc)
+
+      def song():
+        _clear_pdf_caches()
+        for k in songs: pdf.song(io.BytesIO(), k, settings)
+
+      def chordbook():
+        _clear_pdf_caches()
+        pdf.chordbook(io.BytesIO(), songs, 'Cifras por', 'Benchmark',
+            'http://example.com', settings)
+
+      stages = (
+          ('load', load),
+          ('parse', lambda: [parser.parse(k) for k in texts]),
+          ('syntax', lambda: [parser.syntax_analysis(k) for k in tokens]),
+          ('html', lambda: [parser.render_html(k.items()) for k in songs]),
+          ('story', story),
+          ('song', song),
+          ('chordbook', chordbook),
+          )
+
+      for name, function in stages:
+        elapsed = timeit(function)
+        print('%8d %12s %12.4f %14.3f' % (size, name, elapsed,
+          1e3 * elapsed / size))
+        results.append(dict(songs=size, artists=artists,
+          collections=collections, stage=name, seconds=elapsed))
+
+  if args.output:
+    with open(args.output, 'wt') as f:
+      json.dump(dict(
+        commit=_commit(),
+        date=datetime.datetime.now().isoformat(),
+        python=sys.version.split()[0],
+        results=results,
+        ), f, indent=2)
+    print('Results saved to %s' % args.output)
+
+
+def main(argv=None):
+
+  benchmarks = {
+      'chordbook': bench_chordbook,
+      'chordlines': bench_chordlines,
+      'commands': bench_commands,
+      'memory': bench_memory,
+      'suite': bench_suite,
+      'syntax': bench_syntax,
+      'workers': bench_workers,
+      'wrap': bench_wrap,
+      }
+
+  cli = argparse.ArgumentParser(description=__doc__.split('\n')[0])
+  cli.add_argument('benchmark', choices=sorted(benchmarks.keys()),
+      help='which benchmark to run')
+  cli.add_argument('--sizes', type=int, nargs='+',
+      help='problem sizes to run the benchmark for (the default depends on ' \
+          'the benchmark)')
+  cli.add_argument('--corpus', default=_CORPUS,
+      help='directory with song files [default: %(default)s]')
+  cli.add_argument('--output',
+      help='file where to save results as JSON (only for the suite)')
+  args = cli.parse_args(argv)
+
+  benchmarks[args.benchmark](args)
+  return 0
+
+
+if __name__ == '__main__':
+  sys.exit(main())
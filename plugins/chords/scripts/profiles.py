@@ -0,0 +1,80 @@
+#!/usr/bin/env python
+# vim: set fileencoding=utf-8 :
+
+"""Prints the top functions of each profiled phase of a build.
+
+Profiles are dumped by the plugin when ``CHORDS_PROFILE`` is set (e.g.
+``CHORDS_PROFILE=cprofile:pdf``), under ``chords_profile`` in the cache
+directory. Run from the ``plugins`` directory::
+
+  $ python -m chords.scripts.profiles --help
+"""
+
+import os
+import sys
+import glob
+import pstats
+import argparse
+import tracemalloc
+
+
+def print_pstats(path, top, sort):
+  """Prints the functions taking most time on cProfile statistics"""
+
+  stats = pstats.Stats(path)
+  stats.strip_dirs().sort_stats(sort).print_stats(top)
+
+
+def print_tracemalloc(path, top, key):
+  """Prints the places allocating most memory on a tracemalloc snapshot"""
+
+  snapshot = tracemalloc.Snapshot.load(path).filter_traces((
+    tracemalloc.Filter(False, tracemalloc.__file__),
+    tracemalloc.Filter(False, '<frozen importlib._bootstrap*>'),
+    ))
+  stats = snapshot.statistics(key)
+  print('{:,} bytes allocated in {:,} blocks'.format(
+    sum(k.size for k in stats), sum(k.count for k in stats)))
+  for k in stats[:top]:
+    print(k)
+    if key == 'traceback':
+      for line in k.traceback.format(most_recent_first=True): print(line)
+
+
+def main(argv=None):
+
+  cli = argparse.ArgumentParser(description=__doc__.split('\n')[0])
+  cli.add_argument('directory', nargs='?',
+      default=os.path.join('cache', 'chords_profile'),
+      help='where profiles were dumped [default: %(default)s]')
+  cli.add_argument('--phases', nargs='+',
+      help='phases to print (default: all profiled ones)')
+  cli.add_argument('--top', type=int, default=20,
+      help='how many functions to print per phase [default: %(default)s]')
+  cli.add_argument('--sort', default='cumulative',
+      help='sort key for cProfile statistics, e.g. cumulative or tottime ' \
+          '[default: %(default)s]')
+  cli.add_argument('--key', default='lineno',
+      choices=('filename', 'lineno', 'traceback'),
+      help='grouping for tracemalloc snapshots [default: %(default)s]')
+  args = cli.parse_args(argv)
+
+  paths = sorted(glob.glob(os.path.join(args.directory, '*.pstats')) + \
+      glob.glob(os.path.join(args.directory, '*.tracemalloc')))
+  if args.phases:
+    paths = [k for k in paths if \
+        os.path.splitext(os.path.basename(k))[0] in args.phases]
+  if not paths:
+    print('No profiles found at {}'.format(args.directory))
+    return 1
+
+  for path in paths:
+    print('=== {} ==='.format(os.path.basename(path)))
+    if path.endswith('.pstats'): print_pstats(path, args.top, args.sort)
+    else: print_tracemalloc(path, args.top, args.key)
+
+  return 0
+
+
+if __name__ == '__main__':
+  sys.exit(main())
@@ -0,0 +1,53 @@
+#!/usr/bin/env python
+# vim: set fileencoding=utf-8 :
+
+"""Summarizes build reports of the chords plugin.
+
+Prints the most costly items of a build and, given the report of a previous
+build, the items that regressed since. Exits with a non-zero status if any
+did, so it can be used to fail CI runs. Run from the ``plugins`` directory::
+
+  $ python -m chords.scripts.report --help
+"""
+
+import sys
+import argparse
+
+from .. import instrument
+
+
+def main(argv=None):
+
+  cli = argparse.ArgumentParser(description=__doc__.split('\n')[0])
+  cli.add_argument('report', help='build report, as saved by the plugin')
+  cli.add_argument('--baseline',
+      help='build report of a previous build, to compare against')
+  cli.add_argument('--threshold', type=float, default=0.25,
+      help='relative growth tolerated before an item is considered to ' \
+          'have regressed [default: %(default)s]')
+  cli.add_argument('--top', type=int, default=10,
+      help='how many items to show for each metric [default: %(default)s]')
+  args = cli.parse_args(argv)
+
+  report = instrument.load(args.report)
+  for k in instrument.summary(report['items'], args.top): print(k)
+
+  if not args.baseline: return 0
+
+  baseline = instrument.load(args.baseline)
+  if baseline.get('partial'):
+    print('warning: baseline is partial ({}), items it did not measure are ' \
+        'not compared'.format(', '.join(baseline['partial'])))
+  regressions = instrument.regressions(report['items'], baseline['items'],
+      args.threshold)
+  for item, metric, previous, current in regressions:
+    fmt = instrument.METRICS[metric][1]
+    print('regression: {} {} on {}, from {} to {}'.format(item['kind'],
+      item['name'], metric, fmt.format(previous), fmt.format(current)))
+  print('{} regressions beyond {:.0%}'.format(len(regressions),
+    args.threshold))
+  return 1 if regressions else 0
+
+
+if __name__ == '__main__':
+  sys.exit(main())
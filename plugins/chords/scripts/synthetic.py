@@ -0,0 +1,171 @@
+#!/usr/bin/env python
+# vim: set fileencoding=utf-8 :
+
+"""Generates synthetic content for the chords plugin.
+
+Songs mix verses, choruses, tablatures, comments and blank lines, in
+proportions similar to the ones of real songs. The same parameters (and seed)
+always produce the same content. Run from the ``plugins`` directory::
+
+  $ python -m chords.scripts.synthetic --help
+"""
+
+import os
+import sys
+import random
+import argparse
+
+
+_CHORDS = ['C', 'Dm', 'Em', 'F', 'G', 'G7', 'Am', 'A7', 'E7', 'D7', 'Bb',
+    'F#m7', 'B7/9', 'C7M', 'Gm6', 'Ab']
+
+_WORDS = u'''amor saudade coração samba morena noite luar vida tempo mar
+sonho cantar chorar sorrir estrela janela caminho estrada viola pandeiro
+quero vou sei mais nunca sempre você eu ela ele nós de da do que em um uma
+pra com sem só já não ai ô'''.split()
+
+
+def lyrics(rng, length):
+  """Returns a line of random words, about ``length`` characters long"""
+
+  words = []
+  size = 0
+  while size < length:
+    words.append(rng.choice(_WORDS))
+    size += len(words[-1]) + 1
+  return u' '.join(words)
+
+
+def chordline(rng, length):
+  """Returns a line of lyrics with chords inserted between some words"""
+
+  words = lyrics(rng, length).split(u' ')
+  for i in sorted(rng.sample(range(len(words)), min(len(words),
+    rng.randint(1, 4))), reverse=True):
+    words[i] = u'[%s]%s' % (rng.choice(_CHORDS), words[i])
+  return u' '.join(words)
+
+
+def verse(rng):
+  """Returns the lines of a verse, mostly chorded"""
+
+  retval = []
+  for k in range(rng.randint(2, 8)):
+    # a few lines are longer than a page column, so they have to be broken
+    length = rng.choice((30, 40, 50, 60, 70, 120))
+    if rng.random() < 0.8: retval.append(chordline(rng, length))
+    else: retval.append(lyrics(rng, length))
+  return retval
+
+
+def tablature(rng):
+  """Returns the lines of a tablature, with its start and end markers"""
+
+  retval = [u'{start_of_tab}']
+  for string in u'eBGDAE':
+    frets = [rng.choice(u'-----0123') for k in range(rng.randint(20, 50))]
+    retval.append(u'%s|%s' % (string, u'-'.join(frets)))
+  retval.append(u'{end_of_tab}')
+  return retval
+
+
+def song(rng):
+  """Returns the chordpro text of a random song"""
+
+  chorus = [u'{start_of_chorus}'] + verse(rng) + [u'{end_of_chorus}']
+
+  retval = []
+  if rng.random() < 0.3: retval.append(u'{comment: Intro: %s}' % \
+      u' '.join(rng.choice(_CHORDS) for k in range(4)))
+  for k in range(rng.randint(2, 5)):
+    if retval: retval.append(u'')
+    section = rng.random()
+    if section < 0.5: retval += verse(rng)
+    elif section < 0.8: retval += chorus
+    elif section < 0.9: retval += tablature(rng)
+    else: retval.append(u'{c: %s}' % lyrics(rng, 20))
+    if rng.random() < 0.1: retval.append(u'# %s' % lyrics(rng, 30))
+  return u'\n'.join(retval)
+
+
+def _write(path, lines):
+  with open(path, 'wt', encoding='utf-8') as f: f.write(u'\n'.join(lines) + u'\n')
+
+
+def generate(path, artists, songs, collections, seed=0):
+  """Writes synthetic content in the directories used by the plugin
+
+  Files are written to ``artists``, ``songs`` and ``collections``
+  sub-directories of ``path``. Artists have no pictures.
+
+
+  Parameters:
+
+    path (str): The base directory for the content
+
+    artists (int): The number of artists
+
+    songs (int): The number of songs, distributed among artists
+
+    collections (int): The number of collections, each containing a random
+      sample of the songs
+
+    seed (int): The seed for the random number generator
+
+  """
+
+  rng = random.Random(seed)
+
+  for k in ('artists', 'songs', 'collections'):
+    if not os.path.exists(os.path.join(path, k)):
+      os.makedirs(os.path.join(path, k))
+
+  for k in range(artists):
+    _write(os.path.join(path, 'artists', 'artist-%d.yml' % k), [
+      u'name: Artist %d' % k,
+      u'color: 0x%06x' % rng.randint(0, 0xffffff),
+      ])
+
+  for k in range(songs):
+    text = song(rng)
+    _write(os.path.join(path, 'songs', 'song-%d.yml' % k), [
+      u'title: Song %d' % k,
+      u'date: 2017-01-01',
+      u'modified: 2017-01-01',
+      u'performer-slug: artist-%d' % rng.randrange(artists),
+      u'composer-slug: artist-%d' % rng.randrange(artists),
+      u'two-columns: %s' % (u'true' if rng.random() < 0.2 else u'false'),
+      u'tone: %s' % rng.choice(_CHORDS),
+      u'song: |-',
+      ] + [(u'  ' + k) if k else u'' for k in text.split(u'\n')])
+
+  for k in range(collections):
+    sample = sorted(rng.sample(range(songs), min(songs, rng.randint(10, 50))))
+    _write(os.path.join(path, 'collections', 'collection-%d.yml' % k), [
+      u'title: Collection %d' % k,
+      u'date: 2017-01-01',
+      u'modified: 2017-01-01',
+      u'song-slugs:',
+      ] + [u'- song-%d' % i for i in sample])
+
+
+def main(argv=None):
+
+  cli = argparse.ArgumentParser(description=__doc__.split('\n')[0])
+  cli.add_argument('path', help='directory where to write the content')
+  cli.add_argument('--artists', type=int, default=20,
+      help='number of artists [default: %(default)s]')
+  cli.add_argument('--songs', type=int, default=100,
+      help='number of songs [default: %(default)s]')
+  cli.add_argument('--collections', type=int, default=3,
+      help='number of collections [default: %(default)s]')
+  cli.add_argument('--seed', type=int, default=0,
+      help='seed for the random number generator [default: %(default)s]')
+  args = cli.parse_args(argv)
+
+  generate(args.path, args.artists, args.songs, args.collections, args.seed)
+  return 0
+
+
+if __name__ == '__main__':
+  sys.exit(main())
@@ -0,0 +1,66 @@
+#!/usr/bin/env python
+# vim: set fileencoding=utf-8 :
+
+"""Stand-ins for artists and songs, with the attributes used by the PDF
+generation, for tests and benchmarks"""
+
+import os
+import hashlib
+import datetime
+
+from .. import parser, pdf
+
+
+class Performer(object):
+  """An artist, as used by the PDF generation
+
+
+  Parameters:
+
+    name (str): The name of the artist
+
+  """
+
+  def __init__(self, name=u'Test Artist'):
+    self.name = name
+    self.color = 0x336699
+    self.pdf_color = pdf.artist_color(self.color)
+    self.image_path = os.path.realpath(os.path.join(os.path.dirname(__file__),
+      '..', 'img', 'unknown.jpg'))
+    self.thumbnail_path = self.image_path
+
+
+class Song(object):
+  """A song, as used by the PDF generation
+
+
+  Parameters:
+
+    text (str): The chordpro text of the song
+
+    slug (str): The slug of the song
+
+    title (str): The title of the song
+
+    two_columns (bool): If set, the song is laid out on two columns
+
+    performer (Performer): The artist of the song. If not set, a new
+      :py:class:`Performer` is used
+
+  """
+
+  def __init__(self, text, slug, title=u'Test Song', two_columns=False,
+      performer=None):
+    self.song = text
+    self.slug = slug
+    self.title = title
+    self.tone = u'C'
+    self.two_columns = two_columns
+    self.performer = performer or Performer()
+    self.modified = datetime.datetime(2016, 1, 1)
+    self.digest = hashlib.sha1(text.encode('utf-8')).hexdigest()
+    self._items = parser.syntax_analysis(parser.parse(text))
+
+
+  def items(self):
+    return self._items
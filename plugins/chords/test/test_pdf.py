@@ -0,0 +1,58 @@
+#!/usr/bin/env python
+# vim: set fileencoding=utf-8 :
+
+"""Regression tests for the PDF output of songs"""
+
+import io
+import os
+import re
+import locale
+
+from reportlab import rl_config
+
+from .. import pdf
+from .fakes import Song
+
+
+_DATA = os.path.join(os.path.dirname(__file__), 'data')
+
+
+def _text(song):
+  """Returns the strings drawn on the PDF of a song, in order"""
+
+  compression = rl_config.pageCompression
+  rl_config.pageCompression = 0 #so strings can be read from the output
+  # the locale set by pdf.song() is restored from locale.getlocale(), which
+  # may not round-trip for the locale of the test environment
+  saved = locale.setlocale(locale.LC_ALL)
+  locale.setlocale(locale.LC_ALL, 'C')
+  try:
+    output = io.BytesIO()
+    pdf.song(output, song, {'CHORDS_PDF_PRERENDER': False})
+  finally:
+    rl_config.pageCompression = compression
+    locale.setlocale(locale.LC_ALL, saved)
+
+  strings = re.findall(rb'\(((?:[^()\\]|\\.)*)\) Tj', output.getvalue())
+  return [re.sub(rb'\\(.)', rb'\1', k).decode('latin-1') for k in strings]
+
+
+def test_song_text():
+
+  with open(os.path.join(_DATA, 't1.chord'), 'rt') as f:
+    song = Song(f.read(), u'test-song')
+  with open(os.path.join(_DATA, 't1.chord.pdftext'), 'rt') as f:
+    expected = f.read().split('\n')[:-1]
+
+  assert _text(song) == expected
+
+
+def test_split_tall_block():
+
+  # a verse taller than a page is split by ReportLab into new blocks
+  text = u'\n'.join(u'[C]Line %d of a very long [G]verse' % k \
+      for k in range(200))
+  strings = _text(Song(text, u'test-tall-song'))
+
+  for k in range(200): assert strings.count(u'Line %d of a very long verse' \
+      % k) == 1